@@ -6,3 +6,4 @@ from __future__ import absolute_import
 from __future__ import unicode_literals
 
 from .storage import Storage
+from .sharded import ShardedStorage
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import io
+import os
+import json
+
+import six
+
+
+class Checkpoint(object):
+    """Progress of a bucket write stored in a local JSON file.
+
+    The file maps bucket names to the number of source rows committed
+    (`offset`) and the `update_keys` values of the last written row
+    (`last_key`), so several buckets can share one file.
+
+    Args:
+        path (str): path of the checkpoint file
+        bucket (str): bucket name
+
+    """
+
+    def __init__(self, path, bucket):
+        self.path = path
+        self.bucket = bucket
+
+    def load(self):
+        """Return the recorded progress of the bucket or None.
+        """
+        return self.__read().get(self.bucket)
+
+    def save(self, offset, last_key=None):
+        """Record the progress of the bucket.
+        """
+        state = self.__read()
+        state[self.bucket] = {'offset': offset, 'last_key': last_key}
+        self.__write(state)
+
+    def clear(self):
+        """Forget the progress of the bucket.
+        """
+        state = self.__read()
+        if self.bucket in state:
+            del state[self.bucket]
+            self.__write(state)
+
+    # Private
+
+    def __read(self):
+        if not os.path.exists(self.path):
+            return {}
+        with io.open(self.path, encoding='utf-8') as file:
+            return json.load(file)
+
+    def __write(self, state):
+        # Replace the file atomically so a crash never leaves it truncated
+        temp = self.path + '.tmp'
+        with io.open(temp, 'w', encoding='utf-8') as file:
+            file.write(six.text_type(json.dumps(state, default=six.text_type)))
+            file.flush()
+            os.fsync(file.fileno())
+        getattr(os, 'replace', os.rename)(temp, self.path)
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import io
+import csv
+import gzip
+
+import six
+from . import jsoncodec
+
+
+BUFFER_SIZE = 1000
+FORMATS = ['csv', 'ndjson', 'parquet']
+COMPRESSIONS = [None, 'gzip', 'zstd']
+
+
+class StorageDumper(object):
+    """Write rows of a bucket to a file in a streaming fashion.
+
+    Args:
+        headers (list): column names
+        types (list): JSON Table Schema type of every column
+        format (str): `csv`, `ndjson` or `parquet`
+        compression (str): `gzip` or `zstd`
+        json_codec (jsoncodec.Codec): codec of JSON and geojson values
+
+    """
+
+    def __init__(self, headers, types, format='csv', compression=None,
+                 json_codec=jsoncodec.DEFAULT_CODEC):
+
+        if format not in FORMATS:
+            message = 'Format "%s" is not supported' % format
+            raise ValueError(message)
+        if compression not in COMPRESSIONS:
+            message = 'Compression "%s" is not supported' % compression
+            raise ValueError(message)
+
+        self.headers = headers
+        self.types = types
+        self.format = format
+        self.compression = compression
+        self.json_codec = json_codec
+
+    def open(self, path):
+        """Open a binary file applying the compression.
+        """
+        if self.compression == 'gzip':
+            return gzip.open(path, 'wb')
+        if self.compression == 'zstd':
+            import zstandard
+            return zstandard.ZstdCompressor().stream_writer(io.open(path, 'wb'))
+        return io.open(path, 'wb')
+
+    def dump(self, rows, path):
+        if self.format == 'parquet':
+            self.__dump_parquet(rows, path)
+            return
+        with self.open(path) as file:
+            if self.format == 'csv':
+                self.__dump_csv(rows, file)
+            else:
+                self.__dump_ndjson(rows, file)
+
+    # Private
+
+    def __dump_csv(self, rows, file):
+        text = io.TextIOWrapper(file, encoding='utf-8', newline='')
+        writer = csv.writer(text)
+        writer.writerow(self.headers)
+        for row in rows:
+            writer.writerow([self.__encode_text(value) for value in row])
+        text.flush()
+        text.detach()
+
+    def __dump_ndjson(self, rows, file):
+        for row in rows:
+            item = {}
+            for name, type, value in zip(self.headers, self.types, row):
+                if type == 'geojson' and isinstance(value, six.string_types):
+                    value = self.json_codec.loads(value)
+                item[name] = value
+            line = self.json_codec.dumps(item) + '\n'
+            file.write(line.encode('utf-8'))
+
+    def __dump_parquet(self, rows, path):
+        import pyarrow
+        import pyarrow.parquet
+
+        mapping = {
+            'string': pyarrow.string(),
+            'number': pyarrow.float64(),
+            'integer': pyarrow.int64(),
+            'boolean': pyarrow.bool_(),
+            'object': pyarrow.string(),
+            'array': pyarrow.string(),
+            'date': pyarrow.date32(),
+            'time': pyarrow.time64('us'),
+            'datetime': pyarrow.timestamp('us'),
+            'geojson': pyarrow.binary(),
+        }
+        schema = pyarrow.schema([
+            pyarrow.field(name, mapping[type])
+            for name, type in zip(self.headers, self.types)])
+        writer = pyarrow.parquet.ParquetWriter(
+            path, schema, compression=self.compression or 'none')
+        try:
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= BUFFER_SIZE:
+                    writer.write_table(self.__to_arrow(pyarrow, schema, batch))
+                    batch = []
+            if len(batch) > 0:
+                writer.write_table(self.__to_arrow(pyarrow, schema, batch))
+        finally:
+            writer.close()
+
+    def __to_arrow(self, pyarrow, schema, rows):
+        arrays = []
+        for index, type in enumerate(self.types):
+            values = [self.__encode_parquet(type, row[index]) for row in rows]
+            arrays.append(pyarrow.array(values, type=schema[index].type))
+        return pyarrow.Table.from_arrays(arrays, schema=schema)
+
+    def __encode_text(self, value):
+        if isinstance(value, (dict, list)):
+            return self.json_codec.dumps(value)
+        return value
+
+    def __encode_parquet(self, type, value):
+        if value is None:
+            return None
+        if type == 'geojson':
+            from shapely.geometry import shape
+            if isinstance(value, six.string_types):
+                value = self.json_codec.loads(value)
+            return shape(value).wkb
+        if type in ['object', 'array'] or isinstance(value, (dict, list)):
+            return self.json_codec.dumps(value)
+        if type == 'number':
+            return float(value)
+        return value
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import json
+import datetime
+from decimal import Decimal
+from collections import namedtuple
+
+import six
+
+
+CODECS = ['orjson', 'ujson', 'json']
+
+
+# Module API
+
+Codec = namedtuple('Codec', ['name', 'dumps', 'loads'])
+"""JSON codec: its `name` and `dumps`/`loads` functions."""
+
+
+def default(value):
+    """Encode a value JSON doesn't support (`default` of `json.dumps`).
+    """
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return six.text_type(value)
+
+
+def get_codec(codec):
+    """Return a JSON codec used for JSON and geojson values.
+
+    Args:
+        codec (str): `orjson`, `ujson`, `json` or `auto`
+            for the fastest installed one
+
+    Raises:
+        ValueError: if the codec is not supported
+        ImportError: if the codec is not installed
+
+    """
+    if codec == 'auto':
+        for codec in CODECS:
+            try:
+                return get_codec(codec)
+            except ImportError:
+                pass
+    if codec not in CODECS:
+        message = 'JSON codec "%s" is not supported' % codec
+        raise ValueError(message)
+
+    if codec == 'orjson':
+        import orjson
+
+        # Column names are str subclasses, which orjson only takes as keys
+        # with OPT_NON_STR_KEYS
+        def dumps(value):
+            return orjson.dumps(
+                value, default=default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+        return Codec(codec, dumps, orjson.loads)
+
+    if codec == 'ujson':
+        import ujson
+
+        def dumps(value):
+            return ujson.dumps(value, ensure_ascii=False, default=default)
+        return Codec(codec, dumps, ujson.loads)
+
+    def dumps(value):
+        return json.dumps(value, ensure_ascii=False, default=default)
+    return Codec(codec, dumps, json.loads)
+
+
+DEFAULT_CODEC = get_codec('json')
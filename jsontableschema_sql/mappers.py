@@ -4,21 +4,39 @@ from __future__ import print_function
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
-import json
+from copy import deepcopy
 from functools import partial
 
 import six
 from sqlalchemy import (
     Column, PrimaryKeyConstraint, ForeignKeyConstraint, Index, CHAR,
-    Text, String, VARCHAR, NVARCHAR, Float, Integer, Boolean, Date, Time, DateTime)
-from sqlalchemy.types import UserDefinedType
-from sqlalchemy.sql import expression, functions
-from sqlalchemy.dialects.postgresql import ARRAY, JSON, JSONB, UUID
+    Text, String, VARCHAR, NVARCHAR, Float, Numeric, Integer, SmallInteger, BigInteger,
+    Boolean, Date, Time, DateTime, Enum)
+from sqlalchemy.types import JSON, TypeDecorator, UserDefinedType
+from sqlalchemy.sql import expression, functions, func
+from . import jsoncodec
 
-geometry_type = JSONB
+# Column type of geojson fields, JSONB if None (set with geometry support)
+geometry_type = None
+# (name, column) -> Index, set with geometry support
+spatial_index = None
+# (column, bbox, intersects) -> where clause, set with geometry support
+spatial_filter = None
+
+# SRID of bbox and intersects filters without a column SRID
+DEFAULT_SRID = 4326
+
+# Factor applied to sampled values when sizing columns
+SAMPLE_HEADROOM = 100
+
+# Shortest VARCHAR sized by a sample
+SAMPLE_MIN_LENGTH = 256
+
+# Parameters of SDE spatial indexes
+SDE_SPATIAL_INDEX_PARAMETERS = 'st_grids=1,0,0 st_srid=%d'
 
 def load_postgis_support():
-    global geometry_type
+    global geometry_type, spatial_index, spatial_filter
 
     from geoalchemy2 import Geometry
     from sqlalchemy.dialects.postgresql.base import ischema_names
@@ -28,21 +46,45 @@ def load_postgis_support():
 
         as_binary = 'ST_AsGeoJSON'
 
+        def __init__(self, *args, **kwargs):
+            # Spatial indexes are created by `descriptor_to_columns_and_constraints`
+            kwargs.setdefault('spatial_index', False)
+            super(GeoJSON, self).__init__(*args, **kwargs)
+
         def result_processor(self, dialect, coltype):
             def process(value):
                 return value
             return process
 
+    def postgis_spatial_index(name, column):
+        return Index(name, column, postgresql_using='gist')
+
+    def postgis_spatial_filter(column, bbox, intersects):
+        srid = column.type.srid if column.type.srid > 0 else DEFAULT_SRID
+        clauses = []
+        if bbox is not None:
+            envelope = func.ST_MakeEnvelope(*(list(bbox) + [srid]))
+            clauses.append(column.op('&&')(envelope))
+        if intersects is not None:
+            geometry = func.ST_SetSRID(func.ST_GeomFromGeoJSON(intersects), srid)
+            clauses.append(func.ST_Intersects(column, geometry))
+        return expression.and_(*clauses)
+
     ischema_names['geometry'] = GeoJSON
     geometry_type = GeoJSON
+    spatial_index = postgis_spatial_index
+    spatial_filter = postgis_spatial_filter
 
 ## TODO: oracle unicode?
 ## TODO: oracle time?
 
-def load_sde_support(geometry_support, from_srid, to_srid):
-    global geometry_type
+def load_sde_support(geometry_support, from_srid, to_srid,
+                     json_codec=jsoncodec.DEFAULT_CODEC):
+    global geometry_type, spatial_index, spatial_filter
 
     from sqlalchemy.dialects.oracle.base import ischema_names
+    from sqlalchemy.schema import CreateIndex
+    from sqlalchemy.ext.compiler import compiles
     import pyproj
     from shapely.wkt import loads as shp_loads, dumps as shp_dumps
     from shapely.geometry import mapping, shape
@@ -61,7 +103,7 @@ def load_sde_support(geometry_support, from_srid, to_srid):
 
         geojson['crs'] = {'type':'name','properties':{'name':'EPSG:{}'.format(srid)}}
         
-        return json.dumps(geojson)
+        return json_codec.dumps(geojson)
 
     if from_srid and to_srid:
         transformer = partial(
@@ -150,12 +192,36 @@ def load_sde_support(geometry_support, from_srid, to_srid):
 
         def bind_processor(self, dialect):
             def process(bindvalue):
-                shp = shape(json.loads(bindvalue))
+                shp = shape(json_codec.loads(bindvalue))
                 return shp_dumps(shp)
             return process
 
+    @compiles(CreateIndex, 'oracle')
+    def compile_create_index(create, compiler, **kw):
+        text = compiler.visit_create_index(create, **kw)
+        if create.element.info.get('sde_spatial_index'):
+            parameters = SDE_SPATIAL_INDEX_PARAMETERS % (from_srid or DEFAULT_SRID)
+            text += " INDEXTYPE IS SDE.ST_SPATIAL_INDEX PARAMETERS('%s')" % parameters
+        return text
+
+    def sde_spatial_index(name, column):
+        return Index(name, column, info={'sde_spatial_index': True})
+
+    def sde_spatial_filter(column, bbox, intersects):
+        # Filters are in the storage SRID
+        clauses = []
+        if bbox is not None:
+            clauses.append(func.sde.st_envintersects(column, *bbox) == 1)
+        if intersects is not None:
+            wkt = shp_dumps(shape(json_codec.loads(intersects)))
+            geometry = func.sde.st_geometry(wkt, from_srid or DEFAULT_SRID)
+            clauses.append(func.sde.st_intersects(column, geometry) == 1)
+        return expression.and_(*clauses)
+
     ischema_names['ST_GEOMETRY'] = SDE
     geometry_type = SDE
+    spatial_index = sde_spatial_index
+    spatial_filter = sde_spatial_filter
 
 # Module API
 
@@ -175,15 +241,22 @@ def tablename_to_bucket(prefix, tablename):
 
 
 def descriptor_to_columns_and_constraints(prefix, bucket, descriptor,
-                                          index_fields, autoincrement):
+                                          index_fields, autoincrement,
+                                          hash_column=None, compact_types=False):
     """Convert descriptor to SQLAlchemy columns and constraints.
+
+    With `compact_types` the narrowest column type allowed by the field
+    constraints is used (see `get_compact_type`).
     """
 
+    from sqlalchemy.dialects.postgresql import JSONB
+
     # Init
     columns = []
     column_mapping = {}
     constraints = []
     indexes = []
+    spatial_indexes = []
     tablename = bucket_to_tablename(prefix, bucket)
 
     # Mapping
@@ -197,11 +270,13 @@ def descriptor_to_columns_and_constraints(prefix, bucket, descriptor,
         'date': Date,
         'time': Time,
         'datetime': DateTime,
-        'geojson': geometry_type,
+        'geojson': geometry_type or JSONB,
     }
 
     if autoincrement is not None:
         columns.append(Column(autoincrement, Integer, autoincrement=True, nullable=False))
+    if hash_column is not None:
+        columns.append(Column(hash_column, CHAR(32)))
     # Fields
     for field in descriptor['fields']:
         try:
@@ -210,16 +285,22 @@ def descriptor_to_columns_and_constraints(prefix, bucket, descriptor,
             message = 'Type "%s" of field "%s" is not supported'
             message = message % (field['type'], field['name'])
             raise TypeError(message)
+        if compact_types:
+            column_type = get_compact_type(tablename, field, column_type)
         nullable = not field.get('constraints', {}).get('required', False)
         column = Column(field['name'], column_type, nullable=nullable)
         columns.append(column)
         column_mapping[field['name']] = column
+        if field['type'] == 'geojson' and spatial_index is not None:
+            name = tablename + '_gix%03d' % len(spatial_indexes)
+            spatial_indexes.append(spatial_index(name, column))
 
     # Indexes
     for i, index_definition in enumerate(index_fields):
         name = tablename + '_ix%03d' % i
         index_columns = [column_mapping[field_name] for field_name in index_definition]
         indexes.append(Index(name, *index_columns))
+    indexes.extend(spatial_indexes)
 
     # Primary key
     pk = descriptor.get('primaryKey', None)
@@ -256,9 +337,11 @@ def descriptor_to_columns_and_constraints(prefix, bucket, descriptor,
 
 
 def columns_and_constraints_to_descriptor(prefix, tablename, columns,
-                                          constraints, autoincrement_column):
+                                          constraints, autoincrement_column,
+                                          hash_column=None):
     """Convert SQLAlchemy columns and constraints to descriptor.
     """
+    from sqlalchemy.dialects.postgresql import ARRAY, JSON, JSONB, UUID
 
     # Init
     schema = {}
@@ -270,24 +353,27 @@ def columns_and_constraints_to_descriptor(prefix, tablename, columns,
         NVARCHAR: 'string',
         CHAR: 'string',
         UUID: 'string',
+        Enum: 'string',
         Float: 'number',
+        Numeric: 'number',
         Integer: 'integer',
         Boolean: 'boolean',
         JSON: 'object',
         JSONB: 'object',
+        JSONCodecType: 'object',
         ARRAY: 'array',
         Date: 'date',
         Time: 'time',
         DateTime: 'datetime',
     }
 
-    if geometry_type != JSONB:
+    if geometry_type is not None:
         mapping[geometry_type] = 'geojson'
 
     # Fields
     fields = []
     for column in columns:
-        if column.name == autoincrement_column:
+        if column.name in (autoincrement_column, hash_column):
             continue
         field_type = None
         for key, value in mapping.items():
@@ -298,8 +384,17 @@ def columns_and_constraints_to_descriptor(prefix, tablename, columns,
             message = message % (column.type, column.name)
             raise TypeError(message)
         field = {'name': column.name, 'type': field_type}
+        field_constraints = {}
         if not column.nullable:
-            field['constraints'] = {'required': True}
+            field_constraints['required'] = True
+        if isinstance(column.type, UUID):
+            field['format'] = 'uuid'
+        elif isinstance(column.type, Enum):
+            field_constraints['enum'] = list(column.type.enums)
+        elif isinstance(column.type, String) and column.type.length is not None:
+            field_constraints['maxLength'] = column.type.length
+        if field_constraints:
+            field['constraints'] = field_constraints
         fields.append(field)
     schema['fields'] = fields
 
@@ -340,3 +435,117 @@ def columns_and_constraints_to_descriptor(prefix, tablename, columns,
         schema['foreignKeys'] = fks
 
     return schema
+
+
+def get_compact_type(tablename, field, default):
+    """Return the narrowest column type allowed by the field constraints.
+
+    Strings with `format: uuid` become UUID, with an `enum` constraint a
+    native enum and with `maxLength` VARCHAR. Integers become SmallInteger,
+    Integer or BigInteger depending on the `minimum`/`maximum` (or `enum`)
+    constraints. Otherwise `default` is returned.
+    """
+    constraints = field.get('constraints', {})
+
+    # String
+    if field['type'] == 'string':
+        if field.get('format') == 'uuid':
+            from sqlalchemy.dialects.postgresql import UUID
+            return UUID
+        if 'enum' in constraints:
+            name = '%s_%s_enum' % (tablename, field['name'])
+            return Enum(*constraints['enum'], name=name)
+        if 'maxLength' in constraints:
+            return VARCHAR(int(constraints['maxLength']))
+
+    # Integer
+    if field['type'] == 'integer':
+        values = constraints.get('enum')
+        if not values:
+            values = [constraints.get('minimum'), constraints.get('maximum')]
+        bounds = [int(value) for value in values if value is not None]
+        if any(not -2**31 <= value < 2**31 for value in bounds):
+            return BigInteger
+        bounded = len(bounds) == len(values)
+        if bounded and all(-2**15 <= value < 2**15 for value in bounds):
+            return SmallInteger
+
+    return default
+
+
+def sample_to_descriptor(descriptor, rows):
+    """Return a copy of the descriptor sized by a sample of casted rows.
+
+    The copy is only meant to pick compact column types: string fields
+    without `enum`/`maxLength` constraints get a `maxLength` of twice the
+    longest sampled value (rounded up to a power of two, at least
+    `SAMPLE_MIN_LENGTH`). A sample can't bound integers, so it only
+    widens them: integer fields without `enum`/`maximum` get a `maximum`
+    of `SAMPLE_HEADROOM` times the largest sampled magnitude when that
+    needs a BigInteger, and are left as Integer otherwise.
+    """
+    descriptor = deepcopy(descriptor)
+    for index, field in enumerate(descriptor['fields']):
+        constraints = field.get('constraints', {})
+        values = [row[index] for row in rows if row[index] is not None]
+        if not values or 'enum' in constraints:
+            continue
+        if field['type'] == 'string' and field.get('format') != 'uuid':
+            length = SAMPLE_MIN_LENGTH
+            while length < 2 * max(len(value) for value in values):
+                length *= 2
+            constraints.setdefault('maxLength', length)
+        elif field['type'] == 'integer':
+            limit = SAMPLE_HEADROOM * max(abs(value) for value in values)
+            if limit >= 2**31:
+                constraints.setdefault('maximum', limit)
+        if constraints:
+            field['constraints'] = constraints
+    return descriptor
+
+
+class JSONCodecType(TypeDecorator):
+    """JSON column type (de)serializing values with a codec.
+
+    It is JSONB on PostgreSQL. Values are read as text and decoded by the
+    codec instead of the driver or the engine `json_deserializer`.
+
+    Args:
+        json_codec (jsoncodec.Codec): codec of the values
+
+    """
+
+    impl = JSON
+
+    def __init__(self, json_codec=jsoncodec.DEFAULT_CODEC):
+        super(JSONCodecType, self).__init__()
+        self.json_codec = json_codec
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import JSONB
+            return dialect.type_descriptor(JSONB())
+        return dialect.type_descriptor(JSON())
+
+    def bind_processor(self, dialect):
+        dumps = self.json_codec.dumps
+
+        def process(value):
+            if value is JSON.NULL:
+                value = None
+            elif isinstance(value, expression.Null):
+                return None
+            return dumps(value)
+        return process
+
+    def column_expression(self, column):
+        return expression.type_coerce(expression.cast(column, Text), self)
+
+    def result_processor(self, dialect, coltype):
+        loads = self.json_codec.loads
+
+        def process(value):
+            if value is None:
+                return None
+            return loads(value)
+        return process
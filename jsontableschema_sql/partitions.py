@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import json
+import hashlib
+import datetime
+from decimal import Decimal
+
+import six
+from sqlalchemy import text
+
+
+STRATEGIES = ['range', 'list', 'hash']
+INTERVALS = ['day', 'month', 'year']
+COMMENT_KEY = 'partitionBy'
+
+
+# Module API
+
+def validate_spec(spec, descriptor):
+    """Check a partitioning spec against the descriptor.
+
+    PostgreSQL requires the primary key of a partitioned table to include
+    the partitioning field.
+
+    Raises:
+        ValueError: if the spec is not valid
+
+    """
+    types = dict((field['name'], field['type']) for field in descriptor['fields'])
+    field = spec.get('field')
+    strategy = spec.get('strategy')
+    if field not in types:
+        message = 'Partitioning field "%s" is not in the descriptor' % field
+        raise ValueError(message)
+    primary_key = descriptor.get('primaryKey')
+    if isinstance(primary_key, six.string_types):
+        primary_key = [primary_key]
+    if primary_key and field not in primary_key:
+        message = 'Partitioning field "%s" is not in the primary key' % field
+        raise ValueError(message)
+    if strategy not in STRATEGIES:
+        message = 'Partitioning strategy "%s" is not supported' % strategy
+        raise ValueError(message)
+    if strategy == 'range':
+        if types[field] not in ['date', 'datetime']:
+            message = 'Range partitioning field "%s" must be a date or datetime' % field
+            raise ValueError(message)
+        if spec.get('interval') not in INTERVALS:
+            message = 'Range partitioning interval must be one of %s' % INTERVALS
+            raise ValueError(message)
+    if strategy == 'hash':
+        if not isinstance(spec.get('modulus'), six.integer_types):
+            raise ValueError('Hash partitioning requires an integer modulus')
+
+
+def spec_to_comment(spec):
+    """Serialize a partitioning spec to a table comment.
+    """
+    return json.dumps({COMMENT_KEY: spec}, sort_keys=True)
+
+
+def comment_to_spec(comment):
+    """Read a partitioning spec from a table comment or return None.
+    """
+    if not comment:
+        return None
+    try:
+        return json.loads(comment).get(COMMENT_KEY)
+    except (ValueError, AttributeError):
+        return None
+
+
+def partition_by_clause(spec, preparer):
+    """Return the `PARTITION BY` expression of a spec.
+    """
+    return '%s (%s)' % (spec['strategy'].upper(), preparer.quote(spec['field']))
+
+
+def get_partition_names(connection):
+    """Return names of all tables which are partitions (PostgreSQL 10+).
+    """
+    if connection.dialect.server_version_info < (10,):
+        return set()
+    result = connection.execute(text('SELECT relname FROM pg_class WHERE relispartition'))
+    return set(row[0] for row in result)
+
+
+class Partitioner(object):
+    """Create the partitions of a partitioned table.
+
+    Hash partitions and listed values are created up front; range
+    partitions and unlisted values are created when rows need them.
+
+    Args:
+        connection (object): SQLAlchemy connection
+        table (object): SQLAlchemy table
+        spec (dict): partitioning spec
+
+    """
+
+    def __init__(self, connection, table, spec):
+        self.connection = connection
+        self.table = table
+        self.spec = spec
+        self.__preparer = connection.dialect.identifier_preparer
+        self.__existing = None
+
+    def create_partitions(self):
+        """Create the partitions known from the spec.
+        """
+        if self.spec['strategy'] == 'hash':
+            modulus = self.spec['modulus']
+            for remainder in range(modulus):
+                bounds = 'WITH (MODULUS %d, REMAINDER %d)' % (modulus, remainder)
+                self.__create('p%d' % remainder, bounds)
+        elif self.spec['strategy'] == 'list':
+            self.ensure_partitions(
+                {self.spec['field']: value} for value in self.spec.get('values', []))
+
+    def ensure_partitions(self, rows):
+        """Create missing range and list partitions for the rows.
+        """
+        if self.spec['strategy'] == 'hash':
+            return
+        if self.__existing is None:
+            self.__existing = self.__reflect_partitions()
+        for row in rows:
+            value = row[self.spec['field']]
+            if value is None:
+                continue
+            if self.spec['strategy'] == 'range':
+                suffix, bounds = self.__range_bounds(value)
+            else:
+                suffix, bounds = self.__list_bounds(value)
+            if suffix not in self.__existing:
+                self.__create(suffix, bounds)
+
+    # Private
+
+    def __create(self, suffix, bounds):
+        name = self.__preparer.quote('%s_%s' % (self.table.name, suffix))
+        if self.table.schema:
+            name = '%s.%s' % (self.__preparer.quote_schema(self.table.schema), name)
+        statement = 'CREATE TABLE %s PARTITION OF %s FOR VALUES %s' % (
+            name, self.__preparer.format_table(self.table), bounds)
+        self.connection.execute(statement)
+        if self.__existing is not None:
+            self.__existing.add(suffix)
+
+    def __reflect_partitions(self):
+        statement = text(
+            'SELECT c.relname FROM pg_inherits i '
+            'JOIN pg_class c ON c.oid = i.inhrelid '
+            'WHERE i.inhparent = CAST(:parent AS regclass)')
+        parent = self.__preparer.format_table(self.table)
+        prefix = self.table.name + '_'
+        return set(row[0][len(prefix):]
+                   for row in self.connection.execute(statement, parent=parent)
+                   if row[0].startswith(prefix))
+
+    def __range_bounds(self, value):
+        if isinstance(value, datetime.datetime):
+            value = value.date()
+        interval = self.spec['interval']
+        if interval == 'day':
+            lower = value
+            upper = lower + datetime.timedelta(days=1)
+            suffix = lower.strftime('p%Y_%m_%d')
+        elif interval == 'month':
+            lower = value.replace(day=1)
+            upper = (lower + datetime.timedelta(days=31)).replace(day=1)
+            suffix = lower.strftime('p%Y_%m')
+        else:
+            lower = value.replace(month=1, day=1)
+            upper = lower.replace(year=lower.year + 1)
+            suffix = lower.strftime('p%Y')
+        bounds = "FROM ('%s') TO ('%s')" % (lower.isoformat(), upper.isoformat())
+        return suffix, bounds
+
+    def __list_bounds(self, value):
+        literal = six.text_type(value)
+        digest = hashlib.md5(literal.encode('utf-8')).hexdigest()[:8]
+        if isinstance(value, bool):
+            literal = literal.upper()
+        elif not isinstance(value, six.integer_types + (float, Decimal)):
+            if isinstance(value, (datetime.date, datetime.time)):
+                literal = value.isoformat()
+            literal = "'%s'" % literal.replace("'", "''")
+        return 'p%s' % digest, 'IN (%s)' % literal
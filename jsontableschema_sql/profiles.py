@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from sqlalchemy import event, text
+
+
+# Session settings and result fetch size of every profile, by dialect
+PROFILES = {
+    'bulk_load': {
+        'fetch_size': 10000,
+        'postgresql': {
+            'synchronous_commit': 'off',
+            'maintenance_work_mem': '1GB',
+            'work_mem': '256MB',
+        },
+        'oracle': {
+            'commit_wait': 'NOWAIT',
+            'commit_logging': 'BATCH',
+        },
+    },
+    'low_latency': {
+        'fetch_size': 100,
+        'postgresql': {
+            'synchronous_commit': 'local',
+        },
+        'oracle': {
+            'optimizer_mode': 'FIRST_ROWS_100',
+        },
+    },
+    'export': {
+        'fetch_size': 50000,
+        'postgresql': {
+            'work_mem': '256MB',
+        },
+        'oracle': {
+            'optimizer_mode': 'ALL_ROWS',
+        },
+    },
+}
+
+
+# Module API
+
+class SessionProfile(object):
+    """Apply a named profile to the transactions of a connection.
+
+    On PostgreSQL the settings are set locally to every transaction
+    begun between `prepare` and `restore` (`set_config(..., true)`,
+    the same as `SET LOCAL`), so they end with each transaction. On
+    Oracle they are set by `ALTER SESSION` and the previous values
+    (read from `v$parameter`) are set back by `restore`.
+
+    Args:
+        connection (object): SQLAlchemy connection
+        name (str): profile name, see `register_profile`
+
+    Raises:
+        ValueError: if the profile is not registered
+
+    """
+
+    def __init__(self, connection, name):
+        if name not in PROFILES:
+            message = 'Profile "%s" is not registered' % name
+            raise ValueError(message)
+        profile = PROFILES[name]
+        self.connection = connection
+        self.name = name
+        self.fetch_size = profile.get('fetch_size')
+        self.settings = profile.get(connection.dialect.name, {})
+        self.__previous = {}
+
+    def prepare(self):
+        """Apply the profile (outside of a transaction).
+        """
+        if not self.settings:
+            return
+        if self.connection.dialect.name == 'postgresql':
+            event.listen(self.connection, 'begin', self.__set_local)
+        elif self.connection.dialect.name == 'oracle':
+            statement = text('SELECT value FROM v$parameter WHERE name = :name')
+            for name, value in sorted(self.settings.items()):
+                self.__previous[name] = self.connection.execute(
+                    statement, name=name).scalar()
+                self.connection.execute('ALTER SESSION SET %s = %s' % (name, value))
+
+    def restore(self):
+        """Undo `prepare` (outside of a transaction).
+        """
+        if not self.settings:
+            return
+        if self.connection.dialect.name == 'postgresql':
+            event.remove(self.connection, 'begin', self.__set_local)
+        elif self.connection.dialect.name == 'oracle':
+            for name, value in sorted(self.__previous.items()):
+                if value is not None:
+                    self.connection.execute('ALTER SESSION SET %s = %s' % (name, value))
+            self.__previous = {}
+
+    # Private
+
+    def __set_local(self, connection):
+        statement = text('SELECT set_config(:name, :value, true)')
+        for name, value in sorted(self.settings.items()):
+            connection.execute(statement, name=name, value=value)
+
+
+def register_profile(name, profile):
+    """Register a profile.
+
+    Args:
+        name (str): profile name
+        profile (dict): optional `fetch_size` of streamed results and
+            mappings of session settings by dialect name, e.g.
+            `{'fetch_size': 1000, 'postgresql': {'work_mem': '64MB'}}`
+
+    """
+    PROFILES[name] = profile
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import six
+import json
+import time
+import heapq
+import hashlib
+import itertools
+from .writer import WriteSummary
+from . import jsoncodec
+
+
+BUFFER_SIZE = 1000
+
+
+# Module API
+
+class ShardedStorage(object):
+    """SQL Tabular Storage spread over several databases.
+
+    Rows of every bucket are hash-partitioned across the shards by the
+    primary key (or by `update_keys` for buckets without one). Key values
+    are cast by the bucket schema before hashing, so `'1'` and `1` go to
+    the same shard. Rows of buckets without any key are spread evenly.
+    The bucket/descriptor API is the one of `Storage`.
+
+    Args:
+        storages (list): `Storage` instances, one per shard; their order
+            defines the shard of each row and must not change
+
+    """
+
+    # Public
+
+    def __init__(self, storages):
+        if len(storages) == 0:
+            raise ValueError('ShardedStorage requires at least one storage')
+        self.__storages = list(storages)
+
+    def __repr__(self):
+
+        # Template and format
+        template = 'ShardedStorage <{storages}>'
+        text = template.format(
+            storages=', '.join(repr(storage) for storage in self.__storages))
+
+        return text
+
+    @property
+    def storages(self):
+        return list(self.__storages)
+
+    @property
+    def buckets(self):
+        return self.__storages[0].buckets
+
+    def create(self, bucket, descriptor, force=False, **options):
+        """Create buckets on all shards, see `Storage.create`.
+        """
+        for storage in self.__storages:
+            storage.create(bucket, descriptor, force=force, **options)
+
+    def delete(self, bucket=None, ignore=False):
+        """Delete buckets from all shards, see `Storage.delete`.
+        """
+        for storage in self.__storages:
+            storage.delete(bucket, ignore=ignore)
+
+    def describe(self, bucket, descriptor=None):
+        if descriptor is not None:
+            for storage in self.__storages:
+                storage.describe(bucket, descriptor)
+        return self.__storages[0].describe(bucket)
+
+    def iter(self, bucket, ordered=False, **options):
+        """Yield rows of the bucket from all shards.
+
+        Args:
+            bucket (str): bucket name
+            ordered (bool): merge the shards in primary key order
+            options (dict): `Storage.iter` options
+
+        Raises:
+            ValueError: if `ordered` is used on a bucket without primary key
+
+        """
+
+        # Chain shards
+        if not ordered:
+            for storage in self.__storages:
+                for row in storage.iter(bucket, **options):
+                    yield row
+            return
+
+        # Merge shards by primary key
+        descriptor = self.describe(bucket)
+        primary_key = _get_primary_key(descriptor)
+        if not primary_key:
+            message = 'Bucket "%s" has no primary key to order by' % bucket
+            raise ValueError(message)
+        names = self.__storages[0].columns(bucket)
+        indexes = [names.index(name) for name in primary_key]
+        streams = []
+        for shard, storage in enumerate(self.__storages):
+            rows = storage.iter(bucket, order_by=primary_key, **options)
+            streams.append(
+                (tuple(row[index] for index in indexes), shard, number, row)
+                for number, row in enumerate(rows))
+        for _, _, _, row in heapq.merge(*streams):
+            yield row
+
+    def read(self, bucket, **options):
+
+        # Get rows
+        rows = list(self.iter(bucket, **options))
+
+        return rows
+
+    def write(self, bucket, rows, keyed=False, update_keys=None, sync=False,
+              delete_missing=False, collect_ids=False, profile=None, coalesce=False):
+        """Write rows to the bucket, in parallel on every shard.
+
+        Each shard is written by its own thread in its own transaction,
+        see `Storage.write`. With `sync` and `delete_missing` the rows of
+        each shard are synchronized with that shard only. On error the
+        first error is raised once all shards finished; rows already
+        dispatched to the other shards are kept.
+
+        Returns:
+            WriteSummary: totals of all shards (ids of all shards in
+                shard order if collected)
+
+        """
+        import threading
+        from six.moves import queue
+
+        # Prepare
+        start = time.time()
+        get_shard = self.__make_get_shard(bucket, keyed, update_keys)
+        count = len(self.__storages)
+        queues = [queue.Queue(maxsize=4) for _ in range(count)]
+        summaries = [None] * count
+        errors = []
+
+        def work(shard):
+            done = [False]
+
+            def batches():
+                while True:
+                    batch = queues[shard].get()
+                    if batch is None:
+                        done[0] = True
+                        return
+                    for row in batch:
+                        yield row
+
+            try:
+                summaries[shard] = self.__storages[shard].write(
+                    bucket, batches(), keyed=keyed, update_keys=update_keys,
+                    sync=sync, delete_missing=delete_missing,
+                    collect_ids=collect_ids, profile=profile, coalesce=coalesce)
+            except Exception as exception:
+                errors.append(exception)
+                # Keep consuming so the rows dispatcher doesn't block
+                while not done[0]:
+                    if queues[shard].get() is None:
+                        done[0] = True
+
+        # Dispatch rows to shard writers
+        threads = [threading.Thread(target=work, args=(shard,)) for shard in range(count)]
+        for thread in threads:
+            thread.start()
+        try:
+            buffers = [[] for _ in range(count)]
+            for row in rows:
+                if errors:
+                    break
+                shard = get_shard(row)
+                buffers[shard].append(row)
+                if len(buffers[shard]) >= BUFFER_SIZE:
+                    queues[shard].put(buffers[shard])
+                    buffers[shard] = []
+            if not errors:
+                for shard, buffer in enumerate(buffers):
+                    if buffer:
+                        queues[shard].put(buffer)
+        finally:
+            for shard in range(count):
+                queues[shard].put(None)
+            for thread in threads:
+                thread.join()
+        if errors:
+            raise errors[0]
+
+        # Sum up
+        summary = WriteSummary()
+        for shard_summary in summaries:
+            summary.inserted += shard_summary.inserted
+            summary.updated += shard_summary.updated
+            summary.unchanged += shard_summary.unchanged
+            summary.deleted += shard_summary.deleted
+            summary.coalesced += shard_summary.coalesced
+            summary.ids.extend(shard_summary.ids)
+            summary.profile = shard_summary.profile
+        summary.elapsed = time.time() - start
+
+        return summary
+
+    # Private
+
+    def __make_get_shard(self, bucket, keyed, update_keys):
+        from jsontableschema import Schema
+
+        count = len(self.__storages)
+        descriptor = self.describe(bucket)
+        keys = _get_primary_key(descriptor) or update_keys
+        if count == 1:
+            return lambda row: 0
+        if not keys:
+            counter = itertools.count()
+            return lambda row: next(counter) % count
+
+        schema = Schema(descriptor)
+        fields = [schema.get_field(name) for name in keys]
+        if keyed:
+            getters = [lambda row, name=name: row.get(name) for name in keys]
+        else:
+            names = [field['name'] for field in descriptor['fields']]
+            getters = [lambda row, index=names.index(name): row[index] for name in keys]
+
+        def get_shard(row):
+            values = [field.cast_value(getter(row))
+                      for field, getter in zip(fields, getters)]
+            return get_shard_index(values, count)
+
+        return get_shard
+
+
+def get_shard_index(values, count):
+    """Return the shard of key values, stable across processes.
+    """
+    text = json.dumps(values, default=jsoncodec.default, sort_keys=True)
+    digest = hashlib.md5(text.encode('utf-8')).hexdigest()
+    return int(digest[:8], 16) % count
+
+
+# Internal
+
+def _get_primary_key(descriptor):
+    primary_key = descriptor.get('primaryKey')
+    if isinstance(primary_key, six.string_types):
+        primary_key = [primary_key]
+    return primary_key
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import io
+import os
+import pickle
+import struct
+import threading
+
+from .checkpoint import Checkpoint
+
+
+BATCH_SIZE = 10000
+HEADER = struct.Struct(str('>I'))
+
+
+# Module API
+
+class SpoolingWriter(object):
+    """Spool rows to a local file and write them in the background.
+
+    Rows passed to `send` are appended to an append-only file of
+    length-prefixed pickled records, so the producer never waits for the
+    database. A background thread reads the file and calls `write` with
+    batches of up to `batch_size` rows; the byte offset after each written
+    batch is recorded (see `Checkpoint`) once `write` returned. Opening a
+    spool left by a crashed process first replays the rows after the
+    recorded offset, discarding a partially appended last record. The
+    file is truncated whenever everything sent was written, so it only
+    holds the backlog of a long-running writer, and it is removed when
+    the writer is closed with everything written.
+
+    A batch written right before a crash may be written again on replay,
+    so `write` should upsert (`update_keys`) to be idempotent.
+
+    Records are pickled, so replaying a spool can run arbitrary code from
+    its file: `path` must only be writable by the user of the process.
+
+    Args:
+        path (str): path of the spool file, the offset is stored next
+            to it in `<path>.json`
+        bucket (str): bucket name
+        write (callable): called with a list of rows in the background,
+            committing them before returning
+        batch_size (int): maximum number of rows per `write` call
+        finish (callable): called by the background thread when it stops
+
+    Example:
+        with storage.spool('bucket', 'bucket.spool') as spool:
+            for row in rows:
+                spool.send(row)
+
+    """
+
+    def __init__(self, path, bucket, write, batch_size=BATCH_SIZE, finish=None):
+        self.path = path
+        self.bucket = bucket
+        self.batch_size = batch_size
+        self.__write = write
+        self.__finish = finish
+        self.__checkpoint = Checkpoint(path + '.json', bucket)
+        self.__condition = threading.Condition()
+        self.__closing = False
+        self.__drain_all = True
+        self.__error = None
+        self.__sent = 0
+        self.__written = 0
+
+        # Recover
+        state = self.__checkpoint.load()
+        self.__offset = state['offset'] if state else 0
+        self.__truncate_partial()
+
+        # Start draining
+        self.__file = io.open(path, 'ab')
+        self.__thread = threading.Thread(target=self.__drain)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close(drain=type is None)
+
+    @property
+    def sent(self):
+        """Number of rows sent to the spool."""
+        return self.__sent
+
+    @property
+    def written(self):
+        """Number of rows written (including replayed ones)."""
+        return self.__written
+
+    def send(self, row):
+        """Append a row to the spool.
+
+        Raises:
+            Exception: the error of the background write, if any
+
+        """
+        self.__raise_error()
+        data = pickle.dumps(row, protocol=2)
+        with self.__condition:
+            self.__file.write(HEADER.pack(len(data)) + data)
+            self.__file.flush()
+            self.__sent += 1
+            self.__condition.notify()
+
+    def close(self, drain=True):
+        """Stop the spool, waiting for spooled rows to be written.
+
+        With `drain=False` the background write stops after its current
+        batch and the remaining rows are kept for a replay.
+
+        Raises:
+            Exception: the error of the background write, if any
+
+        """
+        with self.__condition:
+            self.__closing = True
+            self.__drain_all = drain
+            self.__condition.notify()
+        self.__thread.join()
+        os.fsync(self.__file.fileno())
+        self.__file.close()
+        self.__raise_error()
+        if drain:
+            os.remove(self.path)
+            if os.path.exists(self.__checkpoint.path):
+                os.remove(self.__checkpoint.path)
+
+    # Private
+
+    def __drain(self):
+        try:
+            with io.open(self.path, 'rb') as file:
+                file.seek(self.__offset)
+                while True:
+                    rows, offset = self.__read_batch(file)
+                    if rows:
+                        self.__write(rows)
+                        self.__checkpoint.save(offset)
+                        self.__offset = offset
+                        self.__written += len(rows)
+                        continue
+                    with self.__condition:
+                        if self.__at_end(file):
+                            self.__truncate_written(file)
+                        if self.__closing and (not self.__drain_all or
+                                               self.__at_end(file)):
+                            return
+                        self.__condition.wait(0.1)
+        except Exception as exception:
+            self.__error = exception
+        finally:
+            if self.__finish is not None:
+                try:
+                    self.__finish()
+                except Exception as exception:
+                    self.__error = self.__error or exception
+
+    def __read_batch(self, file):
+        rows = []
+        offset = file.tell()
+        while len(rows) < self.batch_size:
+            if self.__closing and not self.__drain_all:
+                break
+            header = file.read(HEADER.size)
+            if len(header) < HEADER.size:
+                break
+            size, = HEADER.unpack(header)
+            data = file.read(size)
+            if len(data) < size:
+                break
+            rows.append(pickle.loads(data))
+            offset = file.tell()
+        file.seek(offset)
+        return rows, offset
+
+    def __at_end(self, file):
+        return file.tell() >= os.path.getsize(self.path)
+
+    def __truncate_written(self, file):
+        # Called with the condition held, so no record is being appended.
+        # The offset is reset first: a crash in between replays written
+        # rows instead of losing the rows appended after the truncation
+        if self.__offset == 0:
+            return
+        self.__checkpoint.save(0)
+        self.__offset = 0
+        self.__file.truncate(0)
+        file.seek(0)
+
+    def __truncate_partial(self):
+        # Drop a record partially appended before a crash
+        if not os.path.exists(self.path):
+            return
+        with io.open(self.path, 'r+b') as file:
+            file.seek(self.__offset)
+            end = self.__offset
+            while True:
+                header = file.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    break
+                size, = HEADER.unpack(header)
+                if len(file.read(size)) < size:
+                    break
+                end = file.tell()
+            file.truncate(end)
+
+    def __raise_error(self):
+        if self.__error is not None:
+            raise self.__error
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from sqlalchemy import text, select, func, distinct
+from sqlalchemy.types import JSON, Text, LargeBinary, UserDefinedType
+from .mappers import JSONCodecType
+
+
+# Module API
+
+def get_stats(connection, table, exact=False):
+    """Return statistics of a table.
+
+    Estimates are read from the catalog statistics of PostgreSQL
+    (`pg_class`, `pg_stats`) and Oracle (`ALL_TABLES`, `ALL_INDEXES`,
+    `ALL_TAB_COL_STATISTICS`), so they are as fresh as the last
+    `ANALYZE`/`DBMS_STATS` run. With `exact` (and on other databases)
+    rows, nulls and distinct values are counted by scanning the table.
+
+    Returns:
+        dict: `rows`, `size` (bytes), `indexes` (mapping of index names
+            to bytes) and `columns` (mapping of column names to dicts
+            with `null_fraction` and `distinct`); unknown values are None
+
+    """
+    stats = {'rows': None, 'size': None, 'indexes': {}, 'columns': {}}
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        stats = _get_postgresql_stats(connection, table)
+    elif dialect == 'oracle':
+        stats = _get_oracle_stats(connection, table)
+    if exact or dialect not in ['postgresql', 'oracle']:
+        stats.update(_count_stats(connection, table))
+    return stats
+
+
+def estimate_rows(connection, table):
+    """Return the catalog row estimate of a table (0 before it was
+    ever analyzed on PostgreSQL) or None if the database has none.
+    """
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        statement = text(
+            'SELECT GREATEST(c.reltuples, 0) + COALESCE(('
+            'SELECT SUM(GREATEST(p.reltuples, 0)) FROM pg_inherits i '
+            'JOIN pg_class p ON p.oid = i.inhrelid WHERE i.inhparent = c.oid), 0) '
+            'FROM pg_class c WHERE c.oid = CAST(:table AS regclass)')
+        rows = connection.execute(statement, table=_format_table(connection, table))
+    elif dialect == 'oracle':
+        statement = text(
+            'SELECT num_rows FROM all_tables WHERE owner = %s AND table_name = :table'
+            % _oracle_owner(table))
+        rows = connection.execute(statement, **_oracle_names(connection, table))
+    else:
+        return None
+    rows = rows.scalar()
+    if rows is None:
+        return None
+    return int(rows)
+
+
+# Internal
+
+def _get_postgresql_stats(connection, table):
+    name = _format_table(connection, table)
+    rows = estimate_rows(connection, table)
+
+    # Size
+    statement = text(
+        'SELECT pg_table_size(c.oid) + COALESCE(('
+        'SELECT SUM(pg_table_size(i.inhrelid)) FROM pg_inherits i '
+        'WHERE i.inhparent = c.oid), 0) '
+        'FROM pg_class c WHERE c.oid = CAST(:table AS regclass)')
+    size = connection.execute(statement, table=name).scalar()
+
+    # Indexes
+    statement = text(
+        'SELECT c.relname, pg_relation_size(c.oid) FROM pg_index i '
+        'JOIN pg_class c ON c.oid = i.indexrelid '
+        'WHERE i.indrelid = CAST(:table AS regclass)')
+    indexes = dict((index, int(bytes))
+                   for index, bytes in connection.execute(statement, table=name))
+
+    # Columns (a negative n_distinct is a fraction of the rows)
+    statement = text(
+        'SELECT attname, null_frac, n_distinct FROM pg_stats '
+        'WHERE schemaname = COALESCE(:schema, current_schema()) AND tablename = :table')
+    columns = {}
+    for column, null_fraction, count in connection.execute(
+            statement, schema=table.schema, table=table.name):
+        if count < 0:
+            count = -count * rows if rows is not None else None
+        columns[column] = {
+            'null_fraction': float(null_fraction),
+            'distinct': int(count) if count is not None else None,
+        }
+
+    return {
+        'rows': rows,
+        'size': int(size) if size is not None else None,
+        'indexes': indexes,
+        'columns': columns,
+    }
+
+
+def _get_oracle_stats(connection, table):
+    names = _oracle_names(connection, table)
+    owner = _oracle_owner(table)
+
+    # Rows and size
+    statement = text(
+        'SELECT t.num_rows, t.blocks * s.block_size FROM all_tables t '
+        'LEFT JOIN user_tablespaces s ON s.tablespace_name = t.tablespace_name '
+        'WHERE t.owner = %s AND t.table_name = :table' % owner)
+    rows, size = connection.execute(statement, **names).first() or (None, None)
+
+    # Indexes
+    statement = text(
+        'SELECT i.index_name, i.leaf_blocks * s.block_size FROM all_indexes i '
+        'LEFT JOIN user_tablespaces s ON s.tablespace_name = i.tablespace_name '
+        'WHERE i.table_owner = %s AND i.table_name = :table' % owner)
+    indexes = {}
+    for index, bytes in connection.execute(statement, **names):
+        index = connection.dialect.normalize_name(index)
+        indexes[index] = int(bytes) if bytes is not None else None
+
+    # Columns
+    statement = text(
+        'SELECT column_name, num_nulls, num_distinct FROM all_tab_col_statistics '
+        'WHERE owner = %s AND table_name = :table' % owner)
+    columns = {}
+    for column, nulls, count in connection.execute(statement, **names):
+        column = connection.dialect.normalize_name(column)
+        null_fraction = None
+        if nulls is not None and rows:
+            null_fraction = nulls / rows
+        columns[column] = {
+            'null_fraction': null_fraction,
+            'distinct': int(count) if count is not None else None,
+        }
+
+    return {
+        'rows': int(rows) if rows is not None else None,
+        'size': int(size) if size is not None else None,
+        'indexes': indexes,
+        'columns': columns,
+    }
+
+
+def _count_stats(connection, table):
+    expressions = [func.count()]
+    for column in table.columns:
+        expressions.append(func.count(column))
+        if _is_comparable(connection, column):
+            expressions.append(func.count(distinct(column)))
+    result = list(connection.execute(select(expressions).select_from(table)).first())
+    rows = result.pop(0)
+    columns = {}
+    for column in table.columns:
+        values = result.pop(0)
+        count = None
+        if _is_comparable(connection, column):
+            count = result.pop(0)
+        columns[column.name] = {
+            'null_fraction': (rows - values) / rows if rows else 0.0,
+            'distinct': count,
+        }
+    return {'rows': rows, 'columns': columns}
+
+
+def _is_comparable(connection, column):
+    # JSON, geometry and Oracle LOB values can't be counted as distinct
+    if isinstance(column.type, (JSON, JSONCodecType, UserDefinedType)):
+        return False
+    if connection.dialect.name == 'oracle':
+        return not isinstance(column.type, (Text, LargeBinary))
+    return True
+
+
+def _format_table(connection, table):
+    return connection.dialect.identifier_preparer.format_table(table)
+
+
+def _oracle_owner(table):
+    if table.schema:
+        return ':owner'
+    return "SYS_CONTEXT('USERENV', 'CURRENT_SCHEMA')"
+
+
+def _oracle_names(connection, table):
+    names = {'table': connection.dialect.denormalize_name(table.name)}
+    if table.schema:
+        names['owner'] = connection.dialect.denormalize_name(table.schema)
+    return names
@@ -4,12 +4,29 @@ from __future__ import print_function
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+import io
+import os
 import six
+import time
+import gzip
+import itertools
+import contextlib
 import collections
-import jsontableschema
-from sqlalchemy import Table, MetaData
+from sqlalchemy import Table, MetaData, Text, and_, cast, select, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.types import JSON, Enum
 from . import mappers
-from .writer import StorageWriter
+from . import partitions
+from . import stats
+from . import jsoncodec
+from .writer import StorageWriter, StreamingWriter
+from .profiles import SessionProfile
+from .checkpoint import Checkpoint
+from .spool import SpoolingWriter, BATCH_SIZE
+from .dumper import StorageDumper
+
+
+READ_ROUTINGS = ['round_robin', 'least_loaded']
 
 
 # Module API
@@ -27,12 +44,40 @@ class Storage(object):
             the list of table names when reflecting
         geometry_support (str): Whether to use a geometry column for geojson type.
             Can be `postgis` or `sde`.
+        hash_column (str): name of a column storing a content hash of each
+            row, used by `write(..., sync=True)` to detect changed rows
+        write_strategy (class): `strategies.WriteStrategy` subclass used
+            by writes; defaults to the strategy registered for the dialect
+        json_codec (str): JSON codec for JSON and geojson values of this
+            storage, `orjson`, `ujson`, `json` or `auto` for the fastest
+            installed one. JSON columns are (de)serialized with it instead
+            of the engine `json_serializer`/`json_deserializer`
+        read_engines (list): SQLAlchemy engines of read replicas. Reads
+            (`iter`, `read`, `dump` and reflection) are routed to them,
+            while `create`, `delete` and writes stay on `engine`
+        read_routing (str): replica choice, `round_robin` or
+            `least_loaded` (fewest reads in progress)
+        max_replica_lag (float): seconds a PostgreSQL replica may lag
+            behind the primary to be read from; lagging or unreachable
+            replicas are skipped, falling back to `engine`
+        profile (str): default session profile of writes and reads,
+            `bulk_load`, `low_latency`, `export` or one registered by
+            `profiles.register_profile`; operations taking a `profile`
+            argument can override it
     """
 
     # Public
 
     def __init__(self, engine, dbschema=None, prefix='', reflect_only=None,
-                 autoincrement=None, geometry_support=None, from_srid=None, to_srid=None, views=False):
+                 autoincrement=None, geometry_support=None, from_srid=None, to_srid=None,
+                 views=False, hash_column=None, write_strategy=None, json_codec=None,
+                 read_engines=None, read_routing='round_robin', max_replica_lag=None,
+                 profile=None):
+
+        # Check routing
+        if read_routing not in READ_ROUTINGS:
+            message = 'Read routing "%s" is not supported' % read_routing
+            raise ValueError(message)
 
         # Set attributes
         self.__connection = engine.connect()
@@ -40,24 +85,42 @@ class Storage(object):
         self.__prefix = prefix
         self.__descriptors = {}
         self.__autoincrement = autoincrement
+        self.__hash_column = hash_column
+        self.__write_strategy = write_strategy
         self.__geometry_support = geometry_support
         self.__views = views
+        self.__profile = profile
         if reflect_only is not None:
             self.__only = reflect_only
         else:
             self.__only = lambda _: True
 
+        # Set read replicas
+        self.__read_engines = list(read_engines or [])
+        self.__read_connections = {}
+        self.__read_routing = read_routing
+        self.__read_loads = [0] * len(self.__read_engines)
+        self.__read_cycle = itertools.cycle(range(len(self.__read_engines)))
+        self.__max_replica_lag = max_replica_lag
+
+        # Set JSON codec
+        self.__json_codec = jsoncodec.DEFAULT_CODEC
+        self.__json_columns = json_codec is not None
+        if json_codec is not None:
+            self.__json_codec = jsoncodec.get_codec(json_codec)
+
         # Load geometry support
         if self.__geometry_support == 'postgis':
             mappers.load_postgis_support()
         elif self.__geometry_support in ['sde','sde-char']:
-            mappers.load_sde_support(self.__geometry_support, from_srid, to_srid)
+            mappers.load_sde_support(self.__geometry_support, from_srid, to_srid,
+                                     json_codec=self.__json_codec)
 
-        # Create metadata
-        self.__metadata = MetaData(
+        # Create metadata, reflected on first use
+        self.__meta = MetaData(
             bind=self.__connection,
             schema=self.__dbschema)
-        self.__reflect()
+        self.__reflected = False
 
     def __repr__(self):
 
@@ -81,7 +144,8 @@ class Storage(object):
 
         return buckets
 
-    def create(self, bucket, descriptor, force=False, indexes_fields=None):
+    def create(self, bucket, descriptor, force=False, indexes_fields=None,
+               partition_by=None, compact_types=False, sample=None):
         """Create table by schema.
 
         Parameters
@@ -92,6 +156,24 @@ class Storage(object):
             JSONTableSchema schema or list of schemas.
         indexes_fields: list
             list of tuples containing field names, or list of such lists
+        partition_by: dict/list
+            PostgreSQL (10+) declarative partitioning spec, or list of specs
+            (or None) per table. A spec has a `field` and a `strategy`:
+            `range` with an `interval` (`day`, `month` or `year`) on a date
+            field, `list` with optional initial `values`, or `hash` with a
+            `modulus`. Missing range and list partitions are created by
+            `write`. A `primaryKey` must include the field; the primary key
+            of the autoincrement column of buckets without one is extended
+            by the field.
+        compact_types: bool
+            Use the narrowest column types allowed by the field constraints
+            (SmallInteger/BigInteger, VARCHAR(n), native enums, UUID).
+        sample: list
+            Rows (or list of rows per table) used with `compact_types` to
+            size the VARCHAR columns of strings without length constraints
+            and to widen integers to BigInteger, with headroom for values
+            outside the sample (see `mappers.sample_to_descriptor`). The
+            stored descriptor is not constrained by the sample.
 
         Raises
         ------
@@ -111,8 +193,14 @@ class Storage(object):
             indexes_fields = [()] * len(descriptors)
         elif type(indexes_fields[0][0]) not in {list, tuple}:
             indexes_fields = [indexes_fields]
+        if partition_by is None or isinstance(partition_by, dict):
+            partition_by = [partition_by] * len(descriptors)
+        if sample is None or len(buckets) == 1:
+            sample = [sample] * len(descriptors)
         assert len(indexes_fields) == len(descriptors)
         assert len(buckets) == len(descriptors)
+        assert len(partition_by) == len(descriptors)
+        assert len(sample) == len(descriptors)
 
         # Check buckets for existence
         for bucket in reversed(self.buckets):
@@ -123,21 +211,55 @@ class Storage(object):
                 self.delete(bucket)
 
         # Define buckets
-        for bucket, descriptor, index_fields in zip(buckets, descriptors, indexes_fields):
+        partitioned = []
+        for bucket, descriptor, index_fields, spec, rows in zip(
+                buckets, descriptors, indexes_fields, partition_by, sample):
 
             # Add to schemas
+            import jsontableschema
+            jsontableschema.validate(descriptor)
             self.__descriptors[bucket] = descriptor
 
+            # Size columns by sample
+            column_descriptor = descriptor
+            if compact_types and rows is not None:
+                schema = jsontableschema.Schema(descriptor)
+                rows = [schema.cast_row(row) for row in rows]
+                column_descriptor = mappers.sample_to_descriptor(descriptor, rows)
+
+            # Partition table
+            options = {}
+            if spec is not None:
+                partitions.validate_spec(spec, descriptor)
+                if self.__connection.dialect.name != 'postgresql':
+                    message = 'Partitioning is only supported on PostgreSQL.'
+                    raise RuntimeError(message)
+                if self.__autoincrement is not None and not descriptor.get('primaryKey'):
+                    # Primary keys of partitioned tables include the field
+                    column_descriptor = dict(column_descriptor, primaryKey=spec['field'])
+                    spec = dict(spec, implicitKey=True)
+                options['postgresql_partition_by'] = partitions.partition_by_clause(
+                    spec, self.__connection.dialect.identifier_preparer)
+                options['comment'] = partitions.spec_to_comment(spec)
+
             # Create table
-            jsontableschema.validate(descriptor)
             tablename = mappers.bucket_to_tablename(self.__prefix, bucket)
             columns, constraints, indexes = mappers.descriptor_to_columns_and_constraints(
-                self.__prefix, bucket, descriptor, index_fields, self.__autoincrement)
-            Table(tablename, self.__metadata, *(columns+constraints+indexes))
+                self.__prefix, bucket, column_descriptor, index_fields,
+                self.__autoincrement, self.__hash_column, compact_types)
+            table = Table(tablename, self.__metadata, *(columns+constraints+indexes),
+                          **options)
+            self.__set_json_codec(table)
+            if spec is not None:
+                partitioned.append((table, spec))
 
         # Create tables, update metadata
         self.__metadata.create_all()
 
+        # Create partitions
+        for table, spec in partitioned:
+            partitions.Partitioner(self.__connection, table, spec).create_partitions()
+
     def delete(self, bucket=None, ignore=False):
 
         # Make lists
@@ -149,13 +271,15 @@ class Storage(object):
 
         # Iterate over buckets
         tables = []
+        existent = set(self.buckets)
         for bucket in buckets:
 
             # Check existent
-            if bucket not in self.buckets:
+            if bucket not in existent:
                 if not ignore:
                     message = 'Bucket "%s" doesn\'t exist.' % bucket
                     raise RuntimeError(message)
+                continue
 
             # Remove from buckets
             if bucket in self.__descriptors:
@@ -165,10 +289,82 @@ class Storage(object):
             table = self.__get_table(bucket)
             tables.append(table)
 
-        # Drop tables, update metadata
-        self.__metadata.drop_all(tables=tables)
-        self.__metadata.clear()
-        self.__reflect()
+        # Drop tables (in one statement on PostgreSQL), update metadata
+        if not tables:
+            return
+        if self.__connection.dialect.name == 'postgresql':
+            preparer = self.__connection.dialect.identifier_preparer
+            statement = 'DROP TABLE %s' % ', '.join(
+                preparer.format_table(table) for table in tables)
+            # Native enums (`compact_types`) are not dropped with the tables
+            types = self.__get_enum_types(tables)
+            with self.__connection.begin():
+                self.__connection.execute(statement)
+                if types:
+                    self.__connection.execute('DROP TYPE %s' % ', '.join(
+                        preparer.format_type(type) for type in types))
+        else:
+            self.__metadata.drop_all(tables=tables)
+        for table in tables:
+            self.__metadata.remove(table)
+
+    def truncate(self, bucket=None, restart_identity=False, cascade=False):
+        """Remove all rows of buckets keeping the tables.
+
+        On PostgreSQL all buckets are emptied by a single `TRUNCATE`,
+        on Oracle and MySQL by a `TRUNCATE TABLE` per bucket and on
+        other databases by `DELETE` statements in one transaction.
+
+        Args:
+            bucket (str/list): bucket name or list of bucket names,
+                all buckets if None
+            restart_identity (bool): reset the autoincrement sequences
+                (PostgreSQL only)
+            cascade (bool): also truncate tables referencing the buckets
+                by foreign keys (PostgreSQL only)
+
+        Raises:
+            RuntimeError: if a bucket doesn't exist
+
+        """
+
+        # Make lists
+        buckets = bucket
+        if isinstance(bucket, six.string_types):
+            buckets = [bucket]
+        elif bucket is None:
+            buckets = reversed(self.buckets)
+
+        # Get tables
+        tables = []
+        existent = set(self.buckets)
+        for bucket in buckets:
+            if bucket not in existent:
+                message = 'Bucket "%s" doesn\'t exist.' % bucket
+                raise RuntimeError(message)
+            tables.append(self.__get_table(bucket))
+        if not tables:
+            return
+
+        # Truncate tables
+        dialect = self.__connection.dialect
+        preparer = dialect.identifier_preparer
+        with self.__connection.begin():
+            if dialect.name == 'postgresql':
+                statement = 'TRUNCATE %s' % ', '.join(
+                    preparer.format_table(table) for table in tables)
+                if restart_identity:
+                    statement += ' RESTART IDENTITY'
+                if cascade:
+                    statement += ' CASCADE'
+                self.__connection.execute(statement)
+            elif dialect.name in ['oracle', 'mysql']:
+                for table in tables:
+                    self.__connection.execute(
+                        'TRUNCATE TABLE %s' % preparer.format_table(table))
+            else:
+                for table in tables:
+                    self.__connection.execute(table.delete())
 
     def describe(self, bucket, descriptor=None):
 
@@ -183,52 +379,623 @@ class Storage(object):
                 table = self.__get_table(bucket)
                 descriptor = mappers.columns_and_constraints_to_descriptor(
                     self.__prefix, table.name, table.columns, table.constraints,
-                    self.__autoincrement)
+                    self.__autoincrement, self.__hash_column)
+                spec = partitions.comment_to_spec(table.comment)
+                if spec is not None and spec.get('implicitKey'):
+                    descriptor.pop('primaryKey', None)
 
         return descriptor
 
-    def iter(self, bucket):
+    def columns(self, bucket):
+        """Return the column names of the bucket in the order of `iter` rows,
+        including the autoincrement and hash columns.
+        """
+        return [column.name for column in self.__get_table(bucket).columns]
+
+    def iter(self, bucket, filters=None, raw_json=False, bbox=None, intersects=None,
+             geometry_field=None, order_by=None, profile=None):
+        """Yield rows of the bucket.
+
+        Args:
+            bucket (str): bucket name
+            filters (dict): mapping of field names to a value to match, or
+                to a `(lower, upper)` tuple matching `lower <= value < upper`
+                (None for an open bound). Filters on the partitioning field
+                of a partitioned bucket let the database skip partitions.
+            raw_json (bool): return JSON values as undecoded text
+            bbox (tuple): `(minx, miny, maxx, maxy)` the geometry must
+                intersect, evaluated by the database spatial index
+            intersects (dict/str): GeoJSON geometry the geometry must intersect
+            geometry_field (str): geometry field of `bbox` and `intersects`,
+                required only if the bucket has several geojson fields
+            order_by (list): field names to sort the rows by
+            profile (str): session profile of the read, its `fetch_size`
+                is the number of rows fetched at once
+
+        Raises:
+            RuntimeError: if spatial filters are used without geometry support
+            ValueError: if the geometry field can't be determined
+                or an `order_by` field doesn't exist
+
+        """
 
         # Get result
         table = self.__get_table(bucket)
 
-        # Make sure we close the transaction after iterating,
-        #   otherwise it is left hanging
-        with self.__connection.begin():
-            # Streaming could be not working for some backends:
-            # http://docs.sqlalchemy.org/en/latest/core/connections.html
-            select = table.select().execution_options(stream_results=True)
-            result = select.execute()
+        # Pick a replica
+        replica, connection = self.__get_read_connection()
+        if replica is not None:
+            self.__read_loads[replica] += 1
 
-            # Yield data
-            for row in result:
-                yield list(row)
+        # Apply profile
+        session_profile = None
+        fetch_size = None
+        profile = profile or self.__profile
+        if profile is not None:
+            session_profile = SessionProfile(connection, profile)
+            fetch_size = session_profile.fetch_size
+            session_profile.prepare()
+
+        # Yield rows, releasing the replica afterwards
+        try:
+            for row in self.__iter_rows(
+                    connection, bucket, table, filters, raw_json,
+                    bbox, intersects, geometry_field, order_by, fetch_size):
+                yield row
+        finally:
+            if session_profile is not None:
+                session_profile.restore()
+            if replica is not None:
+                self.__read_loads[replica] -= 1
 
-    def read(self, bucket):
+    def read(self, bucket, **options):
 
         # Get rows
-        rows = list(self.iter(bucket))
+        rows = list(self.iter(bucket, **options))
 
         return rows
 
-    def write(self, bucket, rows, keyed=False, as_generator=False, update_keys=None):
+    def write(self, bucket, rows, keyed=False, as_generator=False, update_keys=None,
+              sync=False, delete_missing=False, checkpoint=None, checkpoint_every=100,
+              collect_ids=False, profile=None, coalesce=False):
+        """Write rows to the bucket.
+
+        With `sync=True` incoming rows are compared to the stored rows with
+        the same `update_keys` by a content hash: changed rows are updated,
+        new rows are inserted and unchanged rows are only reported (as
+        `WrittenRow` with `unchanged=True`). The stored hash is read from
+        `hash_column` if the storage has one, otherwise it is computed from
+        the stored values of each batch. With `delete_missing=True` stored
+        rows whose keys were not written are deleted afterwards.
+
+        With `checkpoint` (path of a local JSON file) the write commits every
+        `checkpoint_every` batches and records the number of source rows
+        committed and the last written key. Calling `write` again with the
+        same rows and checkpoint resumes after the last commit; the file
+        entry is removed once the write completes. With `update_keys` rows
+        replayed after a crash are updated, so resuming is idempotent.
+
+        Unless `as_generator` is set no per-row results are created and a
+        `WriteSummary` with the numbers of inserted, updated, unchanged and
+        deleted rows and the elapsed time is returned. With `collect_ids`
+        it also holds the autoincrement ids as a compact `array`.
+
+        `profile` overrides the session profile of the storage for this
+        write; the profile used is recorded in the `WriteSummary`.
+
+        With `coalesce` rows repeating the `update_keys` of a row buffered
+        in the same batch are merged into it in memory, so every key is
+        inserted or updated once per batch: `True` keeps the last row,
+        a callable is called with the buffered and the new keyed row and
+        returns the merged row. Merged rows yield no `WrittenRow` of
+        their own and are counted as `coalesced` in the `WriteSummary`.
+        """
+
+        if checkpoint is not None and (as_generator or delete_missing):
+            message = 'checkpoint cannot be used with as_generator or delete_missing'
+            raise ValueError(message)
+
+        start = time.time()
+        results = as_generator or (checkpoint is not None and update_keys is not None)
+        writer = self.__make_writer(bucket, update_keys, sync, delete_missing,
+                                    results=results, collect_ids=collect_ids,
+                                    profile=profile, coalesce=coalesce)
+
+        if as_generator:
+            return self.__write_generator(writer, rows, keyed)
+        if checkpoint is not None:
+            self.__write_checkpointed(
+                bucket, writer, rows, keyed, update_keys, checkpoint, checkpoint_every)
+        else:
+            writer.prepare()
+            try:
+                with self.__connection.begin():
+                    collections.deque(writer.write(rows, keyed), maxlen=0)
+            finally:
+                writer.restore()
+        writer.summary.elapsed = time.time() - start
+
+        return writer.summary
+
+    def write_many(self, rows, keyed=False, update_keys=None, workers=4):
+        """Write rows to several buckets concurrently.
+
+        Buckets are written by `workers` threads, each bucket in its own
+        transaction on its own pooled connection. A bucket referencing
+        other written buckets by foreign keys starts only once they are
+        committed. On error no new bucket is started and the first error
+        is raised after running writes finish; buckets already committed
+        are kept.
+
+        Args:
+            rows (dict): mapping of bucket names to rows
+            keyed (bool): whether rows are dicts
+            update_keys (dict): mapping of bucket names to update keys
+            workers (int): number of concurrent writes; with 1 buckets are
+                written in order on the storage connection
+
+        Returns:
+            dict: mapping of bucket names to `WriteSummary`
+
+        Raises:
+            ValueError: if foreign keys between buckets form a cycle
+
+        """
+        import threading
+
+        # Build dependency graph
+        update_keys = update_keys or {}
+        dependencies = {}
+        for bucket in rows:
+            dependencies[bucket] = set()
+            for fk in self.describe(bucket).get('foreignKeys', []):
+                resource = fk['reference']['resource']
+                if resource in rows and resource not in ['self', bucket]:
+                    dependencies[bucket].add(resource)
+        pending = self.__sort_dependencies(dependencies)
+
+        # Write sequentially
+        summaries = {}
+        if workers <= 1:
+            for bucket in pending:
+                summaries[bucket] = self.write(
+                    bucket, rows[bucket], keyed=keyed,
+                    update_keys=update_keys.get(bucket))
+            return summaries
+
+        # Write concurrently
+        done = set()
+        errors = []
+        condition = threading.Condition()
+
+        def next_bucket():
+            with condition:
+                while pending and not errors:
+                    for bucket in pending:
+                        if dependencies[bucket] <= done:
+                            pending.remove(bucket)
+                            return bucket
+                    condition.wait()
+            return None
+
+        def work():
+            while True:
+                bucket = next_bucket()
+                if bucket is None:
+                    return
+                try:
+                    summary = self.__write_on_new_connection(
+                        bucket, rows[bucket], keyed, update_keys.get(bucket))
+                except Exception as exception:
+                    with condition:
+                        errors.append(exception)
+                        condition.notify_all()
+                    return
+                with condition:
+                    summaries[bucket] = summary
+                    done.add(bucket)
+                    condition.notify_all()
+
+        threads = [threading.Thread(target=work) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+        return summaries
+
+    def writer(self, bucket, keyed=False, update_keys=None, sync=False,
+               delete_missing=False, commit_every=None, on_written=None,
+               on_commit=None, profile=None, coalesce=False):
+        """Return a context-managed writer pushing rows into the bucket.
+
+        Rows are passed to `send` and written in bounded batches. Buffered
+        rows can be written with `flush` and committed with `commit`; with
+        `commit_every` a commit happens every N rows, so long feeds run at
+        constant memory. `on_written` is called with every `WrittenRow`
+        and `on_commit` with the number of rows sent when a commit succeeds.
+        The remaining rows are committed on exit, or rolled back on error.
+        `coalesce` is the one of `write`.
+
+        Example:
+            with storage.writer('bucket', commit_every=100000) as writer:
+                for row in rows:
+                    writer.send(row)
+
+        """
+        writer = self.__make_writer(bucket, update_keys, sync, delete_missing,
+                                    results=on_written is not None, profile=profile,
+                                    coalesce=coalesce)
+        return StreamingWriter(self.__connection, writer, keyed=keyed,
+                               commit_every=commit_every, on_written=on_written,
+                               on_commit=on_commit)
+
+    def spool(self, bucket, path, keyed=False, update_keys=None,
+              batch_size=BATCH_SIZE, profile=None):
+        """Return a context-managed writer spooling rows to a local file.
+
+        Rows passed to `send` are appended to the spool file and written
+        to the bucket in batches by a background thread, so a stalled
+        database doesn't block the producer. The thread uses one
+        connection and one writer for all batches, committing each.
+        Rows left in the spool by a crash are written first when the
+        same spool is opened again; use `update_keys` to make the replay
+        idempotent. See `spool.SpoolingWriter`.
+
+        Example:
+            with storage.spool('bucket', 'bucket.spool', update_keys=['id']) as spool:
+                for row in rows:
+                    spool.send(row)
 
+        """
         if update_keys is not None and len(update_keys) == 0:
             raise ValueError('update_keys cannot be an empty list')
+        self.__get_table(bucket)
+
+        # Created by the spool thread on the first batch
+        state = {}
+
+        def write(rows):
+            if not state:
+                state['connection'] = self.__connection.engine.connect()
+                state['writer'] = self.__make_writer(
+                    bucket, update_keys, False, False, results=False,
+                    connection=state['connection'], profile=profile)
+                state['writer'].prepare()
+            with state['connection'].begin():
+                for row in rows:
+                    collections.deque(state['writer'].send(row, keyed), maxlen=0)
+                collections.deque(state['writer'].flush(), maxlen=0)
+
+        def finish():
+            if state:
+                try:
+                    state['writer'].restore()
+                finally:
+                    state['connection'].close()
+
+        return SpoolingWriter(path, bucket, write, batch_size=batch_size, finish=finish)
+
+    def stats(self, bucket, exact=False):
+        """Return statistics of the bucket without scanning it.
+
+        Estimates come from the catalog statistics of PostgreSQL and
+        Oracle, see `stats.get_stats`; on other databases, or with
+        `exact`, rows, nulls and distinct values are counted.
 
+        Returns:
+            dict: `rows`, `size` (bytes), `indexes` (mapping of index
+                names to bytes) and `columns` (mapping of column names
+                to `null_fraction` and `distinct`); unknown values are None
+
+        """
+        table = self.__get_table(bucket)
+        _, connection = self.__get_read_connection()
+        return stats.get_stats(connection, table, exact=exact)
+
+    def load(self, bucket, source, descriptor=None, update_keys=None,
+             copy=False, profile=None, **options):
+        """Stream a tabulator source into the bucket.
+
+        Args:
+            bucket (str): bucket name
+            source (str/object): any source supported by `tabulator.Stream`
+                (CSV, XLSX, JSON, compressed files...)
+            descriptor (dict): descriptor used to create a missing bucket;
+                inferred from a sample of the source if not provided
+            update_keys (list): passed to `write`
+            copy (bool): on PostgreSQL pipe a local CSV file straight to
+                `COPY ... FROM STDIN`. Only used if no casting is needed
+                (no `update_keys`, hash column or geometry field), the
+                source columns are exactly the fields and it is a plain
+                comma-separated file with a single header row (no parsing
+                options), otherwise rows are written through `write`
+            profile (str): session profile of the load
+            options (dict): options passed to `tabulator.Stream`
+
+        Raises:
+            ValueError: if a field of the bucket is missing in the source
+
+        """
+        import jsontableschema
+        from tabulator import Stream
+
+        options.setdefault('headers', 1)
+        plain = options == {'headers': 1}
+        with Stream(source, **options) as stream:
+
+            # Create bucket
+            if bucket not in self.buckets:
+                if descriptor is None:
+                    descriptor = jsontableschema.infer(stream.headers, stream.sample)
+                self.create(bucket, descriptor)
+            descriptor = self.describe(bucket)
+
+            # Map source columns to fields
+            names = [field['name'] for field in descriptor['fields']]
+            for name in names:
+                if name not in stream.headers:
+                    message = 'Field "%s" is missing in the source.' % name
+                    raise ValueError(message)
+
+            # Copy raw bytes
+            if copy and plain and stream.headers == names and \
+                    self.__can_copy(source, stream, descriptor, update_keys):
+                with self.__profiled(self.__connection, profile):
+                    with self.__connection.begin():
+                        self.__copy_csv(bucket, source, stream)
+                return
+
+            # Write rows
+            indexes = [stream.headers.index(name) for name in names]
+            rows = ([row[index] for index in indexes] for row in stream.iter())
+            self.write(bucket, rows, update_keys=update_keys, profile=profile)
+
+    def dump(self, bucket, path, format='csv', compression=None, copy=True,
+             profile=None):
+        """Stream the bucket rows to a file.
+
+        Args:
+            bucket (str): bucket name
+            path (str): output file path
+            format (str): `csv`, `ndjson` or `parquet` (requires `pyarrow`)
+            compression (str): `gzip` or `zstd` (requires `zstandard`)
+            copy (bool): on PostgreSQL write CSV with `COPY ... TO STDOUT`
+            profile (str): session profile of the dump
+
+        Geojson values are written as GeoJSON objects to NDJSON
+        and as WKB (requires `shapely`) to Parquet.
+
+        """
+
+        # Prepare
         table = self.__get_table(bucket)
         descriptor = self.describe(bucket)
+        types = dict((field['name'], field['type']) for field in descriptor['fields'])
+        if self.__autoincrement is not None:
+            types[self.__autoincrement] = 'integer'
+        if self.__hash_column is not None:
+            types[self.__hash_column] = 'string'
+        headers = self.columns(bucket)
+        dumper = StorageDumper(headers, [types[name] for name in headers],
+                               format=format, compression=compression,
+                               json_codec=self.__json_codec)
 
-        writer = StorageWriter(table, descriptor, update_keys, self.__autoincrement)
+        # Copy to file
+        if copy and format == 'csv' and self.__connection.dialect.name == 'postgresql':
+            _, connection = self.__get_read_connection()
+            with self.__profiled(connection, profile):
+                with connection.begin():
+                    with dumper.open(path) as file:
+                        self.__copy_to(connection, table, file)
+            return
 
-        with self.__connection.begin():
-            gen = writer.write(rows, keyed)
-            if as_generator:
-                return gen
-            else:
-                collections.deque(gen, maxlen=0)
+        # Dump rows
+        dumper.dump(self.iter(bucket, profile=profile), path)
 
     # Private
+
+    @property
+    def __metadata(self):
+        if not self.__reflected:
+            self.__reflected = True
+            self.__reflect()
+        return self.__meta
+
+    def __make_writer(self, bucket, update_keys, sync, delete_missing,
+                      results=True, collect_ids=False, connection=None,
+                      profile=None, coalesce=False):
+        if update_keys is not None and len(update_keys) == 0:
+            raise ValueError('update_keys cannot be an empty list')
+        if sync and update_keys is None:
+            raise ValueError('sync requires update_keys')
+        if delete_missing and not sync:
+            raise ValueError('delete_missing requires sync')
+        if coalesce and (update_keys is None or sync):
+            raise ValueError('coalesce requires update_keys and cannot be used with sync')
+
+        if connection is None:
+            connection = self.__connection
+        table = self.__get_table(bucket)
+        descriptor = self.describe(bucket)
+
+        estimated_rows = None
+        if update_keys is not None and not sync:
+            estimated_rows = stats.estimate_rows(connection, table)
+
+        partitioner = None
+        spec = partitions.comment_to_spec(table.comment)
+        if spec is not None:
+            partitioner = partitions.Partitioner(connection, table, spec)
+
+        return StorageWriter(table, descriptor, update_keys, self.__autoincrement,
+                             hash_column=self.__hash_column, sync=sync,
+                             delete_missing=delete_missing, partitioner=partitioner,
+                             connection=connection,
+                             strategy=self.__write_strategy,
+                             results=results, collect_ids=collect_ids,
+                             profile=profile or self.__profile, coalesce=coalesce,
+                             estimated_rows=estimated_rows,
+                             json_codec=self.__json_codec)
+
+    def __write_on_new_connection(self, bucket, rows, keyed, update_keys):
+        start = time.time()
+        connection = self.__connection.engine.connect()
+        try:
+            writer = self.__make_writer(bucket, update_keys, False, False,
+                                        results=False, connection=connection)
+            writer.prepare()
+            try:
+                with connection.begin():
+                    collections.deque(writer.write(rows, keyed), maxlen=0)
+            finally:
+                writer.restore()
+        finally:
+            connection.close()
+        writer.summary.elapsed = time.time() - start
+        return writer.summary
+
+    @staticmethod
+    def __sort_dependencies(dependencies):
+        # Order buckets so that each one follows its dependencies
+        ordered = []
+        while len(ordered) < len(dependencies):
+            ready = [bucket for bucket in dependencies
+                     if bucket not in ordered and dependencies[bucket] <= set(ordered)]
+            if not ready:
+                message = 'Foreign keys between buckets form a cycle.'
+                raise ValueError(message)
+            ordered.extend(sorted(ready))
+        return ordered
+
+    def __filters_clause(self, table, filters):
+        clauses = []
+        for name, value in filters.items():
+            column = table.c[name]
+            if isinstance(value, tuple):
+                lower, upper = value
+                if lower is not None:
+                    clauses.append(column >= lower)
+                if upper is not None:
+                    clauses.append(column < upper)
+            else:
+                clauses.append(column == value)
+        return and_(*clauses)
+
+    def __iter_rows(self, connection, bucket, table, filters, raw_json,
+                    bbox, intersects, geometry_field, order_by, fetch_size):
+        # Make sure we close the transaction after iterating,
+        #   otherwise it is left hanging
+        with connection.begin():
+            # Streaming could be not working for some backends:
+            # http://docs.sqlalchemy.org/en/latest/core/connections.html
+            columns = list(table.columns)
+            if raw_json:
+                columns = [
+                    cast(column, Text).label(column.name)
+                    if isinstance(column.type, (JSON, mappers.JSONCodecType)) else column
+                    for column in columns]
+            statement = select(columns).execution_options(stream_results=True)
+            if fetch_size is not None:
+                statement = statement.execution_options(max_row_buffer=fetch_size)
+            if filters:
+                statement = statement.where(self.__filters_clause(table, filters))
+            if bbox is not None or intersects is not None:
+                statement = statement.where(self.__spatial_clause(
+                    bucket, table, bbox, intersects, geometry_field))
+            for name in order_by or []:
+                if name not in table.c:
+                    message = 'Field "%s" is not in the bucket' % name
+                    raise ValueError(message)
+                statement = statement.order_by(table.c[name])
+            result = connection.execute(statement)
+
+            # Yield data
+            for row in result:
+                yield list(row)
+
+    def __write_generator(self, writer, rows, keyed):
+        # The transaction is opened and closed while the caller iterates
+        writer.prepare()
+        try:
+            with self.__connection.begin():
+                for wr in writer.write(rows, keyed):
+                    yield wr
+        finally:
+            writer.restore()
+
+    def __write_checkpointed(self, bucket, writer, rows, keyed, update_keys,
+                             checkpoint, checkpoint_every):
+
+        # Skip rows committed before
+        checkpoint = Checkpoint(checkpoint, bucket)
+        progress = checkpoint.load()
+        offset = progress['offset'] if progress is not None else 0
+        rows = itertools.islice(rows, offset, None)
+
+        # Record progress on commit
+        last = {'key': None}
+
+        def on_written(wr):
+            if update_keys is not None:
+                last['key'] = [wr.row[key] for key in update_keys]
+
+        def on_commit(sent):
+            checkpoint.save(offset + sent, last['key'])
+
+        # Write rows
+        stream = StreamingWriter(self.__connection, writer, keyed=keyed,
+                                 commit_every=checkpoint_every * writer.buffer_size,
+                                 on_written=on_written, on_commit=on_commit)
+        with stream:
+            for row in rows:
+                stream.send(row)
+        checkpoint.clear()
+
+    def __copy_to(self, connection, table, file):
+        select = table.select().compile(
+            dialect=connection.dialect,
+            compile_kwargs={'literal_binds': True})
+        statement = 'COPY (%s) TO STDOUT WITH CSV HEADER' % select
+        cursor = connection.connection.cursor()
+        cursor.copy_expert(statement, file)
+
+    def __can_copy(self, source, stream, descriptor, update_keys):
+        if self.__connection.dialect.name != 'postgresql':
+            return False
+        if stream.format != 'csv' or stream.compression not in [None, 'gz']:
+            return False
+        dialect = getattr(stream, 'dialect', None) or {}
+        if dialect.get('delimiter', ',') != ',' or dialect.get('quoteChar', '"') != '"':
+            return False
+        if dialect.get('skipInitialSpace'):
+            return False
+        if not isinstance(source, six.string_types) or not os.path.isfile(source):
+            return False
+        if update_keys is not None or self.__hash_column is not None:
+            return False
+        if self.__geometry_support is not None:
+            for field in descriptor['fields']:
+                if field['type'] == 'geojson':
+                    return False
+        return True
+
+    def __copy_csv(self, bucket, source, stream):
+        table = self.__get_table(bucket)
+        preparer = self.__connection.dialect.identifier_preparer
+        columns = ', '.join(preparer.quote(name) for name in stream.headers)
+        encoding = stream.encoding
+        if encoding.lower().replace('-', '').startswith('utf8'):
+            encoding = 'UTF8'
+        statement = 'COPY %s (%s) FROM STDIN WITH CSV HEADER ENCODING \'%s\'' % (
+            preparer.format_table(table), columns, encoding)
+        opener = gzip.open if stream.compression == 'gz' else io.open
+        with opener(source, 'rb') as file:
+            cursor = self.__connection.connection.cursor()
+            cursor.copy_expert(statement, file)
+
     def __get_table(self, bucket):
         """Return SQLAlchemy table for the given bucket.
         """
@@ -240,12 +1007,109 @@ class Storage(object):
 
         return self.__metadata.tables[tablename]
 
+    def __spatial_clause(self, bucket, table, bbox, intersects, geometry_field):
+        if mappers.spatial_filter is None:
+            message = 'Spatial filters require geometry support.'
+            raise RuntimeError(message)
+        if geometry_field is None:
+            names = [field['name'] for field in self.describe(bucket)['fields']
+                     if field['type'] == 'geojson']
+            if len(names) != 1:
+                message = 'Bucket "%s" requires a geometry_field.' % bucket
+                raise ValueError(message)
+            geometry_field = names[0]
+        if isinstance(intersects, dict):
+            intersects = self.__json_codec.dumps(intersects)
+        return mappers.spatial_filter(table.c[geometry_field], bbox, intersects)
+
+    @contextlib.contextmanager
+    def __profiled(self, connection, profile):
+        profile = profile or self.__profile
+        if profile is None:
+            yield
+            return
+        session_profile = SessionProfile(connection, profile)
+        session_profile.prepare()
+        try:
+            yield
+        finally:
+            session_profile.restore()
+
+    def __get_enum_types(self, tables):
+        # Return native enum types of the tables not used by other tables
+        def enums(tables):
+            return [column.type for table in tables for column in table.columns
+                    if isinstance(column.type, Enum) and column.type.native_enum]
+
+        remaining = [table for table in self.__metadata.sorted_tables
+                     if table not in tables]
+        used = set((type.schema, type.name) for type in enums(remaining))
+        types = {}
+        for type in enums(tables):
+            key = (type.schema, type.name)
+            if type.name is not None and key not in used:
+                types.setdefault(key, type)
+        return list(types.values())
+
+    def __get_read_connection(self):
+        # Return (replica index, connection), index is None for the primary
+        indexes = list(range(len(self.__read_engines)))
+        if self.__read_routing == 'least_loaded':
+            indexes.sort(key=lambda index: self.__read_loads[index])
+        elif indexes:
+            start = next(self.__read_cycle)
+            indexes = indexes[start:] + indexes[:start]
+        for index in indexes:
+            try:
+                connection = self.__read_connections.get(index)
+                if connection is None:
+                    connection = self.__read_engines[index].connect()
+                    self.__read_connections[index] = connection
+                if self.__max_replica_lag is not None:
+                    if self.__get_replica_lag(connection) > self.__max_replica_lag:
+                        continue
+            except DBAPIError:
+                self.__read_connections.pop(index, None)
+                continue
+            return index, connection
+        return None, self.__connection
+
+    @staticmethod
+    def __get_replica_lag(connection):
+        # Lag is only known on PostgreSQL standbys (0 on a primary)
+        if connection.dialect.name != 'postgresql':
+            return 0
+        statement = text(
+            'SELECT CASE WHEN pg_is_in_recovery() THEN COALESCE('
+            'EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) '
+            'ELSE 0 END')
+        return float(connection.execute(statement).scalar())
+
     def __reflect(self):
+        # Reflect from a replica if any
+        _, connection = self.__get_read_connection()
+
+        # Partitions are reflected through their parent table
+        excluded = set()
+        if connection.dialect.name == 'postgresql':
+            excluded = partitions.get_partition_names(connection)
+
         def only(name, _):
             ret = (
                 self.__only(name) and
+                name not in excluded and
                 mappers.tablename_to_bucket(self.__prefix, name) is not None
             )
             return ret
 
-        self.__metadata.reflect(only=only, views=self.__views)
+        self.__meta.reflect(bind=connection, only=only, views=self.__views)
+        for table in self.__meta.tables.values():
+            self.__set_json_codec(table)
+
+    def __set_json_codec(self, table):
+        # JSON columns are (de)serialized by the codec of the storage
+        if not self.__json_columns:
+            return
+        for column in table.columns:
+            if isinstance(column.type, JSON):
+                column.type = mappers.JSONCodecType(self.__json_codec)
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from sqlalchemy import event, text, bindparam
+from sqlalchemy.types import UserDefinedType
+
+
+BUFFER_SIZE = 1000
+
+
+# Module API
+
+class WriteStrategy(object):
+    """Generic SQLAlchemy INSERT/UPDATE write path.
+
+    Strategies are keyed by dialect name (see `get_strategy`); subclasses
+    override the parts their backend can do faster.
+
+    Args:
+        connection (object): SQLAlchemy connection
+        table (object): SQLAlchemy table
+        autoincrement (str): autoincrement column name
+        update_keys (list): update keys
+
+    """
+
+    # Rows written per batch
+    buffer_size = BUFFER_SIZE
+
+    def __init__(self, connection, table, autoincrement, update_keys):
+        self.connection = connection
+        self.table = table
+        self.autoincrement = autoincrement
+        self.update_keys = update_keys
+
+    def prepare(self):
+        """Tune the session before writing (outside of a transaction).
+        """
+        pass
+
+    def restore(self):
+        """Undo `prepare` after writing (outside of a transaction).
+        """
+        pass
+
+    def insert(self, rows, direct=False):
+        """Insert rows and return their autoincrement ids (or None).
+
+        `direct` is set when the rows are the only statement run on the
+        table before the transaction is committed, so a backend can use
+        an insert which locks the table for the rest of the transaction.
+        """
+        statement = self.table.insert()
+        if self.autoincrement:
+            statement = statement.returning(getattr(self.table.c, self.autoincrement))
+            statement = statement.values(rows)
+            return [id for id, in self.connection.execute(statement)]
+        self.connection.execute(statement, rows)
+        return None
+
+    def update(self, row):
+        """Update a row by update keys.
+
+        Returns:
+            the autoincrement id, 0 without autoincrement,
+            or None if no row was updated
+
+        """
+        expr = self.table.update().values(row)
+        for key in self.update_keys:
+            expr = expr.where(getattr(self.table.c, key) == row[key])
+        if self.autoincrement:
+            expr = expr.returning(getattr(self.table.c, self.autoincrement))
+        res = self.connection.execute(expr)
+        if res.rowcount > 0:
+            if self.autoincrement:
+                first = next(iter(res))
+                last_row_id = first[0]
+                return last_row_id
+            else:
+                return 0
+        else:
+            return None
+
+    def update_many(self, rows):
+        """Update rows by update keys and return the result of each update.
+        """
+        return [self.update(row) for row in rows]
+
+
+class OracleWriteStrategy(WriteStrategy):
+    """Oracle write path.
+
+    Inserts are array inserts with pre-declared input sizes, so CLOB binds
+    (SDE geometries) are bound as long strings instead of temporary LOBs.
+    A write consisting of a single insert batch is a direct-path insert
+    (`APPEND_VALUES` hint); Oracle forbids any further access to the
+    table in the transaction after it (ORA-12838), so other batches are
+    conventional inserts. Batches of updates without autoincrement are a
+    single array-bound `MERGE`.
+    """
+
+    buffer_size = 10000
+
+    def prepare(self):
+        event.listen(self.connection.engine, 'do_setinputsizes', self.__setinputsizes)
+
+    def restore(self):
+        event.remove(self.connection.engine, 'do_setinputsizes', self.__setinputsizes)
+
+    def insert(self, rows, direct=False):
+        if self.autoincrement or not direct:
+            return super(OracleWriteStrategy, self).insert(rows)
+        statement = self.table.insert().prefix_with('/*+ APPEND_VALUES */')
+        self.connection.execute(statement, rows)
+        return None
+
+    def update_many(self, rows):
+        if self.autoincrement or not rows or self.__has_bind_expressions():
+            return super(OracleWriteStrategy, self).update_many(rows)
+        names = list(rows[0])
+        params = [dict(('p%s' % index, row[name]) for index, name in enumerate(names))
+                  for row in rows]
+        self.connection.execute(self.__merge_statement(names), params)
+        return [0] * len(rows)
+
+    # Private
+
+    def __setinputsizes(self, inputsizes, cursor, statement, parameters, context):
+        dbapi = self.connection.dialect.dbapi
+        for key, dbtype in list(inputsizes.items()):
+            if dbtype is dbapi.CLOB:
+                inputsizes[key] = dbapi.LONG_STRING
+
+    def __has_bind_expressions(self):
+        return any(isinstance(column.type, UserDefinedType) for column in self.table.c)
+
+    def __merge_statement(self, names):
+        # Binds are positional names (p0, p1...): column names can be
+        # reserved words (ORA-01745) or not valid bind names at all
+        preparer = self.connection.dialect.identifier_preparer
+        source = ', '.join(
+            ':p%s AS %s' % (index, preparer.quote(name))
+            for index, name in enumerate(names))
+        condition = ' AND '.join(
+            't.%s = s.%s' % ((preparer.quote(key),) * 2) for key in self.update_keys)
+        assignments = ', '.join(
+            't.%s = s.%s' % ((preparer.quote(name),) * 2)
+            for name in names if name not in self.update_keys)
+        statement = text(
+            'MERGE INTO %s t USING (SELECT %s FROM dual) s ON (%s) '
+            'WHEN MATCHED THEN UPDATE SET %s' % (
+                preparer.format_table(self.table), source, condition, assignments))
+        return statement.bindparams(*[
+            bindparam('p%s' % index, type_=self.table.c[name].type)
+            for index, name in enumerate(names)])
+
+
+class SQLiteWriteStrategy(WriteStrategy):
+    """SQLite write path.
+
+    Large executemany batches run with relaxed durability
+    (`synchronous=OFF`) and a bigger page cache; the previous
+    settings are restored after writing.
+    """
+
+    buffer_size = 10000
+    pragmas = {
+        'synchronous': 'OFF',
+        'temp_store': 'MEMORY',
+        'cache_size': '-65536',
+    }
+
+    def __init__(self, *args, **kwargs):
+        super(SQLiteWriteStrategy, self).__init__(*args, **kwargs)
+        self.__previous = {}
+
+    def prepare(self):
+        for name, value in self.pragmas.items():
+            self.__previous[name] = self.connection.execute('PRAGMA %s' % name).scalar()
+            self.connection.execute('PRAGMA %s = %s' % (name, value))
+
+    def restore(self):
+        for name, value in self.__previous.items():
+            self.connection.execute('PRAGMA %s = %s' % (name, value))
+        self.__previous = {}
+
+
+STRATEGIES = {
+    'oracle': OracleWriteStrategy,
+    'sqlite': SQLiteWriteStrategy,
+}
+
+
+def get_strategy(dialect_name):
+    """Return the write strategy class for a dialect.
+    """
+    return STRATEGIES.get(dialect_name, WriteStrategy)
+
+
+def register_strategy(dialect_name, strategy):
+    """Register a write strategy class for a dialect.
+    """
+    STRATEGIES[dialect_name] = strategy
@@ -5,115 +5,421 @@ from __future__ import absolute_import
 from __future__ import unicode_literals
 
 import json
+import hashlib
+import datetime
+from array import array
+from decimal import Decimal
 
-import pybloom_live
-from sqlalchemy import select
-from collections import namedtuple
+import six
+from sqlalchemy import select, and_, or_
+from collections import namedtuple, OrderedDict
 
-import jsontableschema
-from jsontableschema.exceptions import InvalidObjectType
+from .strategies import BUFFER_SIZE, get_strategy
+from .profiles import SessionProfile
+from . import jsoncodec
 
 
-BUFFER_SIZE = 1000
-WrittenRow = namedtuple('WrittenRow', ['row', 'updated', 'updated_id'])
+# Decimal digits of geojson coordinates (`ST_AsGeoJSON` default)
+GEOJSON_DIGITS = 9
+
+WrittenRow = namedtuple('WrittenRow', ['row', 'updated', 'updated_id', 'unchanged'])
+WrittenRow.__new__.__defaults__ = (False,)
+
+
+class WriteSummary(object):
+    """Aggregate result of a write.
+
+    Attributes:
+        inserted (int): number of inserted rows
+        updated (int): number of updated rows
+        unchanged (int): number of unchanged rows (sync mode)
+        deleted (int): number of deleted rows (sync mode)
+        coalesced (int): number of rows merged into a row with the same
+            update keys in their batch (coalesce mode)
+        elapsed (float): duration in seconds
+        ids (array): autoincrement ids of written rows, if collected
+        profile (str): name of the session profile of the write
+
+    """
+
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.deleted = 0
+        self.coalesced = 0
+        self.elapsed = 0.0
+        self.ids = array(str('l'))
+        self.profile = None
+
+    def __repr__(self):
+        template = 'WriteSummary <inserted={0} updated={1} unchanged={2} deleted={3}>'
+        return template.format(self.inserted, self.updated, self.unchanged, self.deleted)
 
 
 class StorageWriter(object):
 
-    def __init__(self, table, descriptor, update_keys, autoincrement):
+    def __init__(self, table, descriptor, update_keys, autoincrement,
+                 hash_column=None, sync=False, delete_missing=False, partitioner=None,
+                 connection=None, strategy=None, results=True, collect_ids=False,
+                 profile=None, coalesce=False, estimated_rows=None,
+                 json_codec=jsoncodec.DEFAULT_CODEC):
+
+        if connection is None:
+            connection = table.bind
+        if strategy is None:
+            strategy = get_strategy(connection.dialect.name)
 
         self.table = table
+        self.connection = connection
+        self.strategy = strategy(connection, table, autoincrement, update_keys)
         self.descriptor = descriptor
         self.update_keys = update_keys
         self.autoincrement = autoincrement
-        if update_keys is not None:
-            self.__prepare_bloom()
+        self.hash_column = hash_column
+        self.sync = sync
+        self.delete_missing = delete_missing
+        self.partitioner = partitioner
+        self.results = results
+        self.collect_ids = collect_ids and autoincrement is not None
+        self.json_codec = json_codec
+        self.coalesce = None
+        if coalesce:
+            self.coalesce = coalesce
+            if coalesce is True:
+                self.coalesce = _last_write_wins
+        self.profile = None
+        if profile is not None:
+            self.profile = SessionProfile(connection, profile)
+        self.summary = WriteSummary()
+        self.summary.profile = profile
+        self.__field_names = [field['name'] for field in descriptor['fields']]
+        self.__json_types = dict(
+            (field['name'], field['type']) for field in descriptor['fields']
+            if field['type'] in ['object', 'array', 'geojson'])
+        # Imported here to keep the package import light
+        from jsontableschema import Schema
+        from jsontableschema.exceptions import InvalidObjectType
+        self.__schema = Schema(descriptor)
+        self.__invalid_object_type = InvalidObjectType
+        if update_keys is not None and not sync:
+            self.__prepare_bloom(estimated_rows)
         self.__buffer = []
+        self.__buffer_keys = {}
+        self.__updates = OrderedDict()
+        self.__sync_buffer = []
+        self.__finishing = False
+        self.__seen = set()
 
-    def write(self, rows, keyed):
-        # Prepare
-        schema = jsontableschema.Schema(self.descriptor)
+    @property
+    def buffer_size(self):
+        """Number of rows written per batch."""
+        return self.strategy.buffer_size
 
-        # Write
+    def prepare(self):
+        """Prepare the session for writing (outside of a transaction).
+        """
+        if self.profile is not None:
+            self.profile.prepare()
+        self.strategy.prepare()
+
+    def restore(self):
+        """Restore the session after writing (outside of a transaction).
+        """
+        self.strategy.restore()
+        if self.profile is not None:
+            self.profile.restore()
+
+    def write(self, rows, keyed):
         for row in rows:
-            if not keyed:
-                row = self.__convert_to_keyed(schema, row)
+            for wr in self.send(row, keyed):
+                yield wr
+        for wr in self.finish():
+            yield wr
+
+    def send(self, row, keyed):
+        """Buffer a row, writing the buffer when it is full.
+        """
+        if not keyed:
+            row = self.__convert_to_keyed(row)
 
-            keyed_row = row
+        if self.hash_column is not None:
+            row = dict(row)
+            row[self.hash_column] = self.__hash_row(row)
 
-            if self.__check_existing(keyed_row):
-                for wr in self.__insert():
+        keyed_row = row
+
+        if self.sync:
+            self.__sync_buffer.append(keyed_row)
+            if len(self.__sync_buffer) > self.buffer_size:
+                for wr in self.__sync():
                     yield wr
-                ret = self.__update(row)
-                if ret is not None:
+            return
+
+        if self.coalesce is not None:
+            for wr in self.__send_coalesced(keyed_row):
+                yield wr
+            return
+
+        if self.__check_existing(keyed_row):
+            for wr in self.__insert():
+                yield wr
+            ret = self.__update(row)
+            if ret is not None:
+                self.__count_updated([ret])
+                if self.results:
                     yield WrittenRow(keyed_row,
                                      True,
                                      ret if self.autoincrement else None)
-                    continue
+                return
 
-            self.__buffer.append(keyed_row)
+        self.__buffer.append(keyed_row)
 
-            if len(self.__buffer) > BUFFER_SIZE:
-                for wr in self.__insert():
-                    yield wr
+        if len(self.__buffer) > self.buffer_size:
+            for wr in self.__insert():
+                yield wr
 
+    def flush(self):
+        """Write all buffered rows.
+        """
+        if self.sync:
+            for wr in self.__sync():
+                yield wr
+        if self.coalesce is not None:
+            for wr in self.__flush_coalesced():
+                yield wr
         for wr in self.__insert():
             yield wr
 
+    def finish(self):
+        """Write all buffered rows and complete the write.
+        """
+        self.__finishing = True
+        try:
+            for wr in self.flush():
+                yield wr
+        finally:
+            self.__finishing = False
+        if self.delete_missing:
+            self.__delete_missing()
+
     def __insert(self):
         if len(self.__buffer) > 0:
+            # Release the buffer before yielding
+            rows, self.__buffer = self.__buffer, []
+            if self.partitioner is not None:
+                self.partitioner.ensure_partitions(rows)
             # Insert data
-            statement = self.table.insert()
-            if self.autoincrement:
-                statement = statement.returning(getattr(self.table.c, self.autoincrement))
-                statement = statement.values(self.__buffer)
-                res = statement.execute()
-                for id, in res:
-                    row = self.__buffer.pop(0)
+            # A single insert-only batch can be a direct-path insert
+            direct = (self.__finishing and self.summary.inserted == 0 and
+                      self.update_keys is None and not self.sync)
+            ids = self.strategy.insert(rows, direct=direct)
+            self.summary.inserted += len(rows)
+            if self.collect_ids:
+                self.summary.ids.extend(ids)
+            if not self.results:
+                return
+            if ids is not None:
+                for row, id in zip(rows, ids):
                     yield WrittenRow(row, False, id)
             else:
-                statement.execute(self.__buffer)
-                for row in self.__buffer:
+                for row in rows:
                     yield WrittenRow(row, False, None)
-            # Clean memory
-            self.__buffer = []
 
     def __update(self, row):
-        expr = self.table.update().values(row)
-        for key in self.update_keys:
-            expr = expr.where(getattr(self.table.c, key) == row[key])
+        return self.strategy.update(row)
+
+    def __send_coalesced(self, row):
+        # Rows with keys already buffered are merged in memory,
+        #   so each key is written once per batch
+        key = self.__get_key(row)
+        if key in self.__buffer_keys:
+            index = self.__buffer_keys[key]
+            self.__buffer[index] = self.__merge(self.__buffer[index], row)
+            return
+        if key in self.__updates:
+            self.__updates[key] = self.__merge(self.__updates[key], row)
+            return
+        if self.__check_existing(row):
+            self.__updates[key] = row
+        else:
+            self.__buffer_keys[key] = len(self.__buffer)
+            self.__buffer.append(row)
+        if len(self.__buffer) + len(self.__updates) > self.buffer_size:
+            for wr in self.__flush_coalesced():
+                yield wr
+
+    def __flush_coalesced(self):
+        self.__buffer_keys = {}
+        for wr in self.__insert():
+            yield wr
+        rows, self.__updates = list(self.__updates.values()), OrderedDict()
+        # Keys could be false positives of the bloom filter,
+        #   rows which updated nothing are inserted
+        for row in rows:
+            ret = self.__update(row)
+            if ret is None:
+                self.__buffer.append(row)
+                continue
+            self.__count_updated([ret])
+            if self.results:
+                yield WrittenRow(row, True, ret if self.autoincrement else None)
+        for wr in self.__insert():
+            yield wr
+
+    def __merge(self, old, new):
+        row = self.coalesce(old, new)
+        if self.hash_column is not None:
+            row = dict(row)
+            row[self.hash_column] = self.__hash_row(row)
+        self.summary.coalesced += 1
+        return row
+
+    def __count_updated(self, ids):
+        self.summary.updated += len(ids)
+        if self.collect_ids:
+            self.summary.ids.extend(id for id in ids if id is not None)
+
+    def __sync(self):
+        rows, self.__sync_buffer = self.__sync_buffer, []
+        if len(rows) == 0:
+            return
+        existing = self.__fetch_existing(rows)
+
+        # New rows are inserted first, so updates to keys
+        #   repeated within this batch land on the inserted row
+        updates = []
+        for row in rows:
+            key = self.__get_key(row)
+            if self.delete_missing:
+                self.__seen.add(key)
+            digest = self.__get_hash(row)
+            if key not in existing:
+                existing[key] = (digest, None)
+                self.__buffer.append(row)
+                continue
+            stored_digest, row_id = existing[key]
+            if stored_digest == digest:
+                self.summary.unchanged += 1
+                if self.results:
+                    yield WrittenRow(row, False, row_id, True)
+                continue
+            existing[key] = (digest, row_id)
+            updates.append(row)
+
+        for wr in self.__insert():
+            yield wr
+        ids = self.strategy.update_many(updates)
+        self.__count_updated(ids)
+        if not self.results:
+            return
+        for row, ret in zip(updates, ids):
+            yield WrittenRow(row, True, ret if self.autoincrement else None)
+
+    def __fetch_existing(self, rows):
+        """Return a mapping of key to (hash, autoincrement id)
+        for the rows of the batch already stored in the table.
+        """
+        names = list(self.update_keys)
         if self.autoincrement:
-            expr = expr.returning(getattr(self.table.c, self.autoincrement))
-        res = expr.execute()
-        if res.rowcount > 0:
-            if self.autoincrement:
-                first = next(iter(res))
-                last_row_id = first[0]
-                return last_row_id
-            else:
-                return 0
+            names.append(self.autoincrement)
+        if self.hash_column is not None:
+            names.append(self.hash_column)
         else:
-            return None
+            names.extend(name for name in self.__field_names if name not in names)
+        keys = set(self.__get_key(row) for row in rows)
+        columns = [getattr(self.table.c, name) for name in names]
+        statement = select(columns).where(self.__keys_clause(keys))
+        existing = {}
+        for stored in self.connection.execute(statement):
+            key = tuple(stored[name] for name in self.update_keys)
+            if self.hash_column is not None:
+                digest = stored[self.hash_column]
+            else:
+                digest = self.__hash_row(stored)
+            row_id = stored[self.autoincrement] if self.autoincrement else None
+            existing[key] = (digest, row_id)
+        return existing
+
+    def __delete_missing(self):
+        columns = [getattr(self.table.c, key) for key in self.update_keys]
+        statement = select(columns).execution_options(stream_results=True)
+        keys = self.connection.execute(statement)
+        stale = [tuple(key) for key in keys if tuple(key) not in self.__seen]
+        for offset in range(0, len(stale), BUFFER_SIZE):
+            chunk = stale[offset:offset + BUFFER_SIZE]
+            statement = self.table.delete().where(self.__keys_clause(chunk))
+            self.summary.deleted += self.connection.execute(statement).rowcount
+
+    def __keys_clause(self, keys):
+        columns = [getattr(self.table.c, key) for key in self.update_keys]
+        if len(columns) == 1:
+            return columns[0].in_([key[0] for key in keys])
+        return or_(*[and_(*[column == value for column, value in zip(columns, key)])
+                     for key in keys])
+
+    def __get_key(self, row):
+        return tuple(row[key] for key in self.update_keys)
+
+    def __get_hash(self, row):
+        if self.hash_column is not None:
+            return row[self.hash_column]
+        return self.__hash_row(row)
 
-    @staticmethod
-    def __convert_to_keyed(schema, row):
+    def __hash_row(self, row):
+        """Return a content hash of the descriptor fields of the row.
+
+        Values are normalized so that casted input values and values
+        read back from the database produce the same hash. JSON text is
+        decoded, and geojson is compared without `crs` and with the
+        coordinate precision of `ST_AsGeoJSON`.
+        """
+        values = []
+        for name in self.__field_names:
+            value = row[name]
+            if name in self.__json_types:
+                value = self.__normalize_json(self.__json_types[name], value)
+            elif isinstance(value, Decimal):
+                value = float(value)
+            elif isinstance(value, datetime.datetime) and value.tzinfo is not None:
+                value = value.replace(tzinfo=None)
+            values.append(value)
+        text = json.dumps(values, sort_keys=True, default=six.text_type)
+        return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+    def __normalize_json(self, type, value):
+        if isinstance(value, six.string_types):
+            try:
+                value = self.json_codec.loads(value)
+            except ValueError:
+                return value
+        if type == 'geojson' and isinstance(value, dict):
+            value = dict((key, item) for key, item in value.items() if key != 'crs')
+            value = _round_floats(value, GEOJSON_DIGITS)
+        return value
+
+    def __convert_to_keyed(self, row):
         keyed_row = {}
-        for index, field in enumerate(schema.fields):
+        for index, field in enumerate(self.__schema.fields):
             value = row[index]
             if field.type != 'geojson':
                 try:
                     value = field.cast_value(value)
-                except InvalidObjectType:
-                    value = json.loads(value)
+                except self.__invalid_object_type:
+                    value = self.json_codec.loads(value)
             keyed_row[field.name] = value
 
         return keyed_row
 
-    def __prepare_bloom(self):
-        self.bloom = pybloom_live.ScalableBloomFilter()
+    def __prepare_bloom(self, estimated_rows):
+        import pybloom_live
+        # Sized for the stored keys up front instead of growing
+        #   through many small filters
+        capacity = max(estimated_rows or 0, 100)
+        self.bloom = pybloom_live.ScalableBloomFilter(initial_capacity=capacity)
         columns = [getattr(self.table.c, key) for key in self.update_keys]
-        keys = select(columns).execution_options(stream_results=True).execute()
-        for key in keys:
+        statement = select(columns).execution_options(stream_results=True)
+        for key in self.connection.execute(statement):
             self.bloom.add(key)
 
     def __check_existing(self, row):
@@ -126,3 +432,108 @@ class StorageWriter(object):
                 return False
         else:
             return False
+
+
+class StreamingWriter(object):
+    """Context-managed writer pushing rows into a bucket.
+
+    Rows are sent one by one and written in batches of bounded size.
+    Results are passed to callbacks instead of being collected.
+
+    Args:
+        connection (object): SQLAlchemy connection
+        writer (StorageWriter): writer of the bucket
+        keyed (bool): whether rows are dicts
+        commit_every (int): commit after this number of sent rows
+        on_written (callable): called with every `WrittenRow`
+        on_commit (callable): called with the number of rows sent
+            when a commit succeeds
+
+    """
+
+    def __init__(self, connection, writer, keyed=False, commit_every=None,
+                 on_written=None, on_commit=None):
+
+        self.__connection = connection
+        self.__writer = writer
+        self.__keyed = keyed
+        self.__commit_every = commit_every
+        self.__on_written = on_written
+        self.__on_commit = on_commit
+        self.__transaction = None
+        self.__sent = 0
+
+    def __enter__(self):
+        self.__writer.prepare()
+        self.__transaction = self.__connection.begin()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        try:
+            if type is None:
+                self.__drain(self.__writer.finish())
+                self.commit(restart=False)
+            else:
+                self.__transaction.rollback()
+        except Exception:
+            self.__transaction.rollback()
+            raise
+        finally:
+            self.__transaction = None
+            self.__writer.restore()
+
+    @property
+    def sent(self):
+        """Number of rows sent."""
+        return self.__sent
+
+    @property
+    def summary(self):
+        """`WriteSummary` of the rows written so far."""
+        return self.__writer.summary
+
+    def send(self, row):
+        """Send a row to the bucket.
+        """
+        self.__drain(self.__writer.send(row, self.__keyed))
+        self.__sent += 1
+        if self.__commit_every and self.__sent % self.__commit_every == 0:
+            self.commit()
+
+    def flush(self):
+        """Write buffered rows without committing.
+        """
+        self.__drain(self.__writer.flush())
+
+    def commit(self, restart=True):
+        """Write buffered rows and commit the transaction.
+        """
+        self.flush()
+        self.__transaction.commit()
+        if self.__on_commit is not None:
+            self.__on_commit(self.__sent)
+        if restart:
+            self.__transaction = self.__connection.begin()
+
+    # Private
+
+    def __drain(self, written):
+        for wr in written:
+            if self.__on_written is not None:
+                self.__on_written(wr)
+
+
+# Internal
+
+def _last_write_wins(old, new):
+    return new
+
+
+def _round_floats(value, digits):
+    if isinstance(value, float):
+        return round(value, digits)
+    if isinstance(value, dict):
+        return dict((key, _round_floats(item, digits)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [_round_floats(item, digits) for item in value]
+    return value
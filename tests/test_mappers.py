@@ -6,6 +6,9 @@ from __future__ import unicode_literals
 
 import pytest
 from mock import Mock
+from sqlalchemy import (
+    MetaData, Table, SmallInteger, Integer, BigInteger, VARCHAR, Enum, Text)
+from sqlalchemy.dialects.postgresql import UUID
 from jsontableschema_sql import mappers
 
 
@@ -33,3 +36,112 @@ def test_columns_and_constraints_to_descriptor_not_supported_type():
     with pytest.raises(TypeError):
         mappers.columns_and_constraints_to_descriptor(
             'prefix_', 'tablename', [Mock()], [])
+
+
+def test_descriptor_to_columns_and_constraints_compact_types():
+    descriptor = {
+        'fields': [
+            {'name': 'id', 'type': 'integer',
+             'constraints': {'minimum': 0, 'maximum': 100}},
+            {'name': 'big', 'type': 'integer', 'constraints': {'maximum': 2**40}},
+            {'name': 'code', 'type': 'string', 'constraints': {'maxLength': 8}},
+            {'name': 'status', 'type': 'string',
+             'constraints': {'enum': ['open', 'closed']}},
+            {'name': 'uid', 'type': 'string', 'format': 'uuid'},
+            {'name': 'text', 'type': 'string'},
+        ],
+    }
+    columns, constraints, indexes = mappers.descriptor_to_columns_and_constraints(
+        'prefix_', 'bucket', descriptor, [], None, compact_types=True)
+    types = [column.type for column in columns]
+    assert isinstance(types[0], SmallInteger)
+    assert isinstance(types[1], BigInteger)
+    assert isinstance(types[2], VARCHAR) and types[2].length == 8
+    assert isinstance(types[3], Enum) and types[3].enums == ['open', 'closed']
+    assert isinstance(types[4], UUID)
+    assert isinstance(types[5], Text)
+    descriptor = mappers.columns_and_constraints_to_descriptor(
+        'prefix_', 'prefix_bucket', columns, constraints, None)
+    assert descriptor['fields'][2]['constraints'] == {'maxLength': 8}
+    assert descriptor['fields'][3]['constraints'] == {'enum': ['open', 'closed']}
+    assert descriptor['fields'][4]['format'] == 'uuid'
+    assert [field['type'] for field in descriptor['fields']] == [
+        'integer', 'integer', 'string', 'string', 'string', 'string']
+
+
+def test_sample_to_descriptor():
+    descriptor = {
+        'fields': [
+            {'name': 'id', 'type': 'integer'},
+            {'name': 'name', 'type': 'string'},
+        ],
+    }
+    rows = [[1, 'ulysses'], [5, None], [3, 'zeus']]
+    sized = mappers.sample_to_descriptor(descriptor, rows)
+    assert 'constraints' not in sized['fields'][0]
+    assert sized['fields'][1]['constraints'] == {'maxLength': 256}
+    assert 'constraints' not in descriptor['fields'][0]
+    rows = [[-2**30, 'x' * 200], [7, '']]
+    sized = mappers.sample_to_descriptor(descriptor, rows)
+    assert sized['fields'][0]['constraints'] == {'maximum': 100 * 2**30}
+    assert sized['fields'][1]['constraints'] == {'maxLength': 512}
+
+
+def test_sample_to_descriptor_never_narrows_integers():
+    descriptor = {'fields': [{'name': 'id', 'type': 'integer'}]}
+    sized = mappers.sample_to_descriptor(descriptor, [[id] for id in range(1, 101)])
+    columns, _, _ = mappers.descriptor_to_columns_and_constraints(
+        'prefix_', 'bucket', sized, [], None, compact_types=True)
+    assert type(columns[0].type) is Integer
+
+
+def test_columns_and_constraints_to_descriptor_keys():
+    metadata = MetaData()
+    descriptors = {
+        'authors': {
+            'fields': [{'name': 'id', 'type': 'integer'}],
+            'primaryKey': 'id',
+        },
+        'articles': {
+            'fields': [
+                {'name': 'id', 'type': 'integer'},
+                {'name': 'parent', 'type': 'integer'},
+                {'name': 'author', 'type': 'integer'},
+            ],
+            'primaryKey': 'id',
+            'foreignKeys': [
+                {'fields': 'parent',
+                 'reference': {'resource': 'self', 'fields': 'id'}},
+                {'fields': 'author',
+                 'reference': {'resource': 'authors', 'fields': 'id'}},
+            ],
+        },
+    }
+    for bucket in ['authors', 'articles']:
+        columns, constraints, _ = mappers.descriptor_to_columns_and_constraints(
+            'prefix_', bucket, descriptors[bucket], [], None)
+        table = Table('prefix_' + bucket, metadata, *(columns + constraints))
+    descriptor = mappers.columns_and_constraints_to_descriptor(
+        'prefix_', table.name, table.columns, table.constraints, None)
+    descriptor['foreignKeys'].sort(key=lambda fk: fk['fields'], reverse=True)
+    assert descriptor['primaryKey'] == 'id'
+    assert descriptor['foreignKeys'] == descriptors['articles']['foreignKeys']
+
+
+def test_descriptor_to_columns_and_constraints_spatial_index(monkeypatch):
+    pytest.importorskip('geoalchemy2')
+    for name in ['geometry_type', 'spatial_index', 'spatial_filter']:
+        monkeypatch.setattr(mappers, name, getattr(mappers, name))
+    mappers.load_postgis_support()
+    descriptor = {
+        'fields': [
+            {'name': 'id', 'type': 'integer'},
+            {'name': 'location', 'type': 'geojson'},
+        ],
+    }
+    columns, constraints, indexes = mappers.descriptor_to_columns_and_constraints(
+        'prefix_', 'bucket', descriptor, [['id']], None)
+    assert [index.name for index in indexes] == [
+        'prefix_bucket_ix000', 'prefix_bucket_gix000']
+    assert indexes[1].kwargs['postgresql_using'] == 'gist'
+    assert columns[1].type.spatial_index is False
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import sys
+import json
+import subprocess
+
+
+# Seconds allowed to import the package on top of SQLAlchemy
+IMPORT_TIME_BUDGET = 0.25
+
+# Modules only imported by the features using them
+LAZY_MODULES = [
+    'jsontableschema',
+    'tabulator',
+    'pybloom_live',
+    'geoalchemy2',
+    'shapely',
+    'pyproj',
+    'sqlalchemy.dialects.postgresql',
+]
+
+
+# Tests
+
+def test_import_lazy_modules():
+    code = (
+        'import sys, json, jsontableschema_sql;'
+        'print(json.dumps(sorted(sys.modules)))')
+    modules = json.loads(run(code))
+    assert [name for name in LAZY_MODULES if name in modules] == []
+
+
+def test_import_time_budget():
+    code = (
+        'import time, sqlalchemy;'
+        'start = time.time();'
+        'import jsontableschema_sql;'
+        'print(time.time() - start)')
+    elapsed = min(float(run(code)) for _ in range(3))
+    assert elapsed < IMPORT_TIME_BUDGET
+
+
+# Helpers
+
+def run(code):
+    output = subprocess.check_output([sys.executable, '-c', code])
+    return output.decode('utf-8').strip()
@@ -7,12 +7,17 @@ from __future__ import unicode_literals
 import os
 import io
 import json
+import gzip
+import zipfile
+import time
+import datetime
 import pytest
 from copy import deepcopy
 from tabulator import Stream
 from jsontableschema import Schema
 from sqlalchemy import create_engine
-from jsontableschema_sql import Storage
+from jsontableschema_sql import Storage, ShardedStorage
+from jsontableschema_sql.strategies import WriteStrategy
 from dotenv import load_dotenv; load_dotenv('.env')
 
 
@@ -71,6 +76,10 @@ def test_storage():
     assert list(storage.read('articles')) == sync_rows(articles_descriptor, articles_rows)
     assert list(storage.read('comments')) == sync_rows(comments_descriptor, comments_rows)
 
+    # Assert raw JSON
+    rows = storage.read('articles', raw_json=True)
+    assert json.loads(rows[0][9]) == {'chars': 560}
+
     # Delete non existent bucket
     with pytest.raises(RuntimeError):
         storage.delete('non_existent')
@@ -118,6 +127,11 @@ def test_update():
     assert len(list(filter(lambda i: i.updated, gen))) == 5
     assert list(map(lambda i: i.updated_id, gen)) == [5, 3, 6, 4, 5]
 
+    summary = storage.write('colors', update_rows, update_keys=update_keys,
+                            collect_ids=True)
+    assert summary.updated == 5
+    assert list(summary.ids) == [5, 3, 6, 4, 5]
+
     # Create new storage to use reflection only
     storage = Storage(engine=engine, prefix='test_update_')
 
@@ -150,6 +164,228 @@ def test_update():
     assert list(map(lambda i: i.updated_id, gen)) == [None, None, None, None, None]
 
 
+def test_sync():
+
+    # Get resources
+    descriptor = json.load(io.open('data/original.json', encoding='utf-8'))
+    original_rows = Stream('data/original.csv', headers=1).open().read()
+    update_rows = Stream('data/update.csv', headers=1).open().read()
+    update_keys = ['person_id']
+
+    # Engine
+    engine = create_engine(os.environ['DATABASE_URL'])
+
+    for hash_column in [None, '__hash']:
+
+        # Storage
+        storage = Storage(engine=engine, prefix='test_sync_', hash_column=hash_column)
+        storage.delete()
+        storage.create('colors', descriptor)
+        storage.write('colors', original_rows, update_keys=update_keys)
+
+        # Unchanged rows
+        gen = storage.write('colors', original_rows, update_keys=update_keys,
+                            sync=True, as_generator=True)
+        gen = list(gen)
+        assert len(gen) == 4
+        assert all(i.unchanged and not i.updated for i in gen)
+
+        # Changed, new and missing rows
+        gen = storage.write('colors', update_rows, update_keys=update_keys,
+                            sync=True, delete_missing=True, as_generator=True)
+        gen = list(gen)
+        assert len(gen) == 5
+        assert len(list(filter(lambda i: i.updated, gen))) == 3
+        assert not any(i.unchanged for i in gen)
+        assert storage.describe('colors') == descriptor
+
+        # Summary
+        summary = storage.write('colors', update_rows, update_keys=update_keys,
+                                sync=True)
+        assert (summary.inserted, summary.updated, summary.unchanged) == (0, 2, 3)
+        assert sorted(row[-3:] for row in storage.read('colors')) == [
+            [3, 'perseus', 'magenta'],
+            [4, 'dedalus', 'sunshine'],
+            [5, 'apollo', 'peach'],
+            [6, 'zeus', 'grey'],
+        ]
+
+
+def test_sync_json():
+
+    # Storage
+    descriptor = {'fields': [
+        {'name': 'id', 'type': 'integer'},
+        {'name': 'meta', 'type': 'object'},
+        {'name': 'location', 'type': 'geojson'},
+    ]}
+    rows = [
+        [1, '{"chars": 560, "tags": ["a"]}', '{"type": "Point", "coordinates": [1.5, 2]}'],
+        [2, '{"chars": 1}', '{"coordinates": [3, 4], "type": "Point"}'],
+    ]
+    engine = create_engine(os.environ['DATABASE_URL'])
+    for hash_column in [None, '__hash']:
+        storage = Storage(engine=engine, prefix='test_sync_json_',
+                          hash_column=hash_column, json_codec='json')
+        storage.delete()
+        storage.create('bucket', descriptor)
+        storage.write('bucket', [
+            {'id': 1, 'meta': {'tags': ['a'], 'chars': 560},
+             'location': {'type': 'Point', 'coordinates': [1.5, 2]}},
+            {'id': 2, 'meta': {'chars': 1},
+             'location': {'type': 'Point', 'coordinates': [3, 4]}},
+        ], keyed=True, update_keys=['id'])
+
+        # Unchanged rows (stored values against JSON text)
+        summary = storage.write('bucket', rows, update_keys=['id'], sync=True)
+        assert (summary.updated, summary.unchanged) == (0, 2)
+
+        # Changed rows
+        rows[1][1] = '{"chars": 2}'
+        summary = storage.write('bucket', rows, update_keys=['id'], sync=True)
+        assert (summary.updated, summary.unchanged) == (1, 1)
+        rows[1][1] = '{"chars": 1}'
+
+
+def test_load(tmpdir):
+
+    # Engine
+    engine = create_engine(os.environ['DATABASE_URL'])
+
+    # Storage
+    storage = Storage(engine=engine, prefix='test_load_')
+    storage.delete()
+
+    # Load with inferred descriptor
+    storage.load('colors', 'data/original.csv')
+    descriptor = storage.describe('colors')
+    assert [field['type'] for field in descriptor['fields']] == [
+        'integer', 'string', 'string']
+    assert len(storage.read('colors')) == 4
+
+    # Load into existent bucket
+    storage.load('colors', 'data/update.csv', copy=True)
+    rows = storage.read('colors')
+    assert len(rows) == 9
+    assert rows[-1] == [5, 'apollo', 'peach']
+
+    # Load a source COPY can't read (extra column, other delimiter)
+    path = str(tmpdir.join('extra.csv'))
+    with io.open(path, 'w', encoding='utf-8') as file:
+        file.write('person_id;name;favorite_color;extra\n7;hermes;white;x\n')
+    storage.load('colors', path, copy=True)
+    assert storage.read('colors')[-1] == [7, 'hermes', 'white']
+
+    # Load a zipped source
+    path = str(tmpdir.join('colors.csv.zip'))
+    with zipfile.ZipFile(path, 'w') as archive:
+        archive.writestr('colors.csv', 'person_id,name,favorite_color\n8,iris,violet\n')
+    storage.load('colors', path, copy=True)
+    assert storage.read('colors')[-1] == [8, 'iris', 'violet']
+
+
+def test_dump(tmpdir):
+
+    # Engine
+    engine = create_engine(os.environ['DATABASE_URL'])
+
+    # Storage
+    storage = Storage(engine=engine, prefix='test_dump_')
+    storage.delete()
+    storage.load('colors', 'data/original.csv')
+
+    # Dump to CSV
+    path = str(tmpdir.join('colors.csv.gz'))
+    storage.dump('colors', path, compression='gzip')
+    with gzip.open(path, 'rt') as file:
+        lines = file.read().splitlines()
+    assert lines[0] == 'person_id,name,favorite_color'
+    assert lines[1] == '1,ulysses,blue'
+    assert len(lines) == 5
+
+    # Dump to NDJSON
+    path = str(tmpdir.join('colors.ndjson'))
+    storage.dump('colors', path, format='ndjson')
+    with io.open(path, encoding='utf-8') as file:
+        items = [json.loads(line) for line in file]
+    assert items[0] == {'person_id': 1, 'name': 'ulysses', 'favorite_color': 'blue'}
+    assert len(items) == 4
+
+    # Not supported format
+    with pytest.raises(ValueError):
+        storage.dump('colors', path, format='xml')
+
+
+def test_partitioning():
+
+    # Engine
+    engine = create_engine(os.environ['DATABASE_URL'])
+
+    # Storage
+    descriptor = {'fields': [
+        {'name': 'id', 'type': 'integer'},
+        {'name': 'created', 'type': 'date'},
+    ]}
+    rows = [
+        [1, '2016-01-15'],
+        [2, '2016-02-15'],
+        [3, '2016-02-16'],
+    ]
+    storage = Storage(engine=engine, prefix='test_partitioning_')
+    storage.delete()
+    storage.create('bucket', descriptor, partition_by={
+        'field': 'created', 'strategy': 'range', 'interval': 'month'})
+    storage.write('bucket', rows)
+
+    # Partitions are not buckets
+    storage = Storage(engine=engine, prefix='test_partitioning_')
+    assert storage.buckets == ['bucket']
+
+    # Filtered rows
+    storage.write('bucket', [[4, '2016-03-01']])
+    rows = storage.iter('bucket', filters={
+        'created': (datetime.date(2016, 2, 1), datetime.date(2016, 3, 1))})
+    assert sorted(row[0] for row in rows) == [2, 3]
+
+    # Not valid spec
+    with pytest.raises(ValueError):
+        storage.create('other', descriptor, partition_by={
+            'field': 'id', 'strategy': 'range', 'interval': 'month'})
+
+    # Autoincrement primary key
+    storage = Storage(engine=engine, prefix='test_partitioning_auto_',
+                      autoincrement='__id')
+    storage.delete()
+    storage.create('bucket', descriptor, partition_by={
+        'field': 'created', 'strategy': 'range', 'interval': 'month'})
+    storage.write('bucket', rows)
+    storage = Storage(engine=engine, prefix='test_partitioning_auto_',
+                      autoincrement='__id')
+    assert storage.describe('bucket') == descriptor
+    assert len(storage.read('bucket')) == 3
+
+
+def test_partitioning_primary_key():
+
+    # Storage
+    engine = create_engine(os.environ['DATABASE_URL'])
+    storage = Storage(engine=engine, prefix='test_partitioning_primary_key_')
+    storage.delete()
+    descriptor = {
+        'fields': [
+            {'name': 'id', 'type': 'integer'},
+            {'name': 'created', 'type': 'date'},
+        ],
+        'primaryKey': 'id',
+    }
+
+    # Partitioning field is not in the primary key
+    with pytest.raises(ValueError):
+        storage.create('bucket', descriptor, partition_by={
+            'field': 'created', 'strategy': 'range', 'interval': 'month'})
+    assert storage.buckets == []
+
+
 def test_bad_type():
 
     # Engine
@@ -209,7 +445,9 @@ def test_storage_bigdata():
     engine = create_engine(os.environ['DATABASE_URL'])
     storage = Storage(engine=engine, prefix='test_storage_bigdata_')
     storage.create('bucket', descriptor, force=True)
-    storage.write('bucket', rows, keyed=True)
+    summary = storage.write('bucket', rows, keyed=True)
+    assert summary.inserted == 2500
+    assert summary.updated == 0
 
     # Pull rows
     assert list(storage.read('bucket')) == list(map(lambda x: [x['id']], rows))
@@ -234,6 +472,458 @@ def test_storage_bigdata_rollback():
     assert list(storage.read('bucket')) == []
 
 
+def test_storage_writer():
+
+    # Generate schema/data
+    descriptor = {'fields': [{'name': 'id', 'type': 'integer'}]}
+    rows = [(value,) for value in range(0, 2500)] + [('bad-value',)]
+
+    # Push rows
+    engine = create_engine(os.environ['DATABASE_URL'])
+    storage = Storage(engine=engine, prefix='test_storage_writer_',
+                      write_strategy=WriteStrategy)
+    storage.create('bucket', descriptor, force=True)
+    written = []
+    commits = []
+    with pytest.raises(Exception):
+        with storage.writer('bucket', commit_every=1000,
+                            on_written=written.append,
+                            on_commit=commits.append) as writer:
+            for row in rows:
+                writer.send(row)
+
+    # Pull rows
+    assert commits == [1000, 2000]
+    assert len(written) == 2000
+    assert list(storage.read('bucket')) == [[value] for value in range(0, 2000)]
+
+
+def test_storage_write_checkpoint(tmpdir):
+
+    # Generate schema/data
+    descriptor = {'fields': [{'name': 'id', 'type': 'integer'}]}
+    rows = [(value,) for value in range(0, 2500)]
+    path = str(tmpdir.join('checkpoint.json'))
+
+    # Push rows failing after two checkpoints
+    engine = create_engine(os.environ['DATABASE_URL'])
+    storage = Storage(engine=engine, prefix='test_storage_write_checkpoint_',
+                      write_strategy=WriteStrategy)
+    storage.create('bucket', descriptor, force=True)
+    with pytest.raises(Exception):
+        storage.write('bucket', rows + [('bad-value',)],
+                      checkpoint=path, checkpoint_every=1)
+    assert len(storage.read('bucket')) == 2000
+    assert json.load(io.open(path))['bucket']['offset'] == 2000
+
+    # Resume
+    storage.write('bucket', rows, checkpoint=path, checkpoint_every=1)
+    assert list(storage.read('bucket')) == [[value] for value in range(0, 2500)]
+    assert json.load(io.open(path)) == {}
+
+
+def test_storage_write_strategy():
+
+    # Generate schema/data
+    descriptor = {'fields': [{'name': 'id', 'type': 'integer'}]}
+    rows = [(value,) for value in range(0, 2500)]
+    batches = []
+
+    class CountingStrategy(WriteStrategy):
+        buffer_size = 500
+
+        def insert(self, rows, direct=False):
+            batches.append((len(rows), direct))
+            return super(CountingStrategy, self).insert(rows, direct)
+
+    # Push rows
+    engine = create_engine(os.environ['DATABASE_URL'])
+    storage = Storage(engine=engine, prefix='test_storage_write_strategy_',
+                      write_strategy=CountingStrategy)
+    storage.create('bucket', descriptor, force=True)
+    storage.write('bucket', rows)
+
+    # Pull rows (only a single insert batch may be direct)
+    assert batches == [(501, False)] * 4 + [(496, False)]
+    assert list(storage.read('bucket')) == [[value] for value in range(0, 2500)]
+    del batches[:]
+    storage.write('bucket', rows[:100])
+    assert batches == [(100, True)]
+    del batches[:]
+    storage.write('bucket', rows[:100], update_keys=['id'])
+    assert batches == []
+
+
+def test_oracle_write_strategy_merge():
+
+    # Prepare
+    from mock import Mock
+    from sqlalchemy import MetaData, Table, Column, Integer, Date
+    from sqlalchemy.dialects import oracle
+    from jsontableschema_sql.strategies import OracleWriteStrategy
+    table = Table('bucket', MetaData(), Column('id', Integer),
+                  Column('date', Date), Column('level', Integer))
+    connection = Mock(dialect=oracle.dialect())
+    strategy = OracleWriteStrategy(connection, table, None, ['id'])
+
+    # Binds are not named by columns (reserved words)
+    rows = [{'id': 1, 'date': None, 'level': 2}, {'id': 2, 'date': None, 'level': 3}]
+    strategy.update_many(rows)
+    statement, params = connection.execute.call_args[0]
+    sql = str(statement.compile(dialect=connection.dialect))
+    assert ':p0 AS id, :p1 AS "date", :p2 AS "level" FROM dual' in sql
+    assert params == [{'p0': 1, 'p1': None, 'p2': 2}, {'p0': 2, 'p1': None, 'p2': 3}]
+
+
+def test_storage_write_many():
+
+    # Generate schema/data
+    parents = {'primaryKey': 'id', 'fields': [{'name': 'id', 'type': 'integer'}]}
+    children = {
+        'fields': [{'name': 'parent', 'type': 'integer'}],
+        'foreignKeys': [{
+            'fields': 'parent',
+            'reference': {'resource': 'parents', 'fields': 'id'},
+        }],
+    }
+    others = {'fields': [{'name': 'id', 'type': 'integer'}]}
+    rows = [(value,) for value in range(0, 2500)]
+
+    # Push rows
+    engine = create_engine(os.environ['DATABASE_URL'])
+    storage = Storage(engine=engine, prefix='test_storage_write_many_')
+    storage.delete()
+    storage.create(['parents', 'children', 'others'], [parents, children, others])
+    summaries = storage.write_many(
+        {'children': rows, 'parents': rows, 'others': rows}, workers=2)
+
+    # Pull rows
+    assert sorted(summaries) == ['children', 'others', 'parents']
+    assert all(summary.inserted == 2500 for summary in summaries.values())
+    for bucket in ['parents', 'children', 'others']:
+        assert len(storage.read(bucket)) == 2500
+
+
+def test_storage_read_engines():
+
+    # Push rows
+    engine = create_engine(os.environ['DATABASE_URL'])
+    storage = Storage(engine=engine, prefix='test_storage_read_engines_')
+    storage.delete()
+    storage.create('bucket', {'fields': [{'name': 'id', 'type': 'integer'}]})
+    storage.write('bucket', [(1,), (2,)])
+
+    # Pull rows from a replica (the same database stands for it here),
+    #   skipping an unreachable one
+    unreachable = create_engine('sqlite:////nonexistent/replica.db')
+    replica = create_engine(os.environ['DATABASE_URL'])
+    storage = Storage(engine=engine, prefix='test_storage_read_engines_',
+                      read_engines=[unreachable, replica], read_routing='least_loaded')
+    assert storage.buckets == ['bucket']
+    assert storage.read('bucket') == [[1], [2]]
+    assert storage.read('bucket') == [[1], [2]]
+
+    # Unknown routing
+    with pytest.raises(ValueError):
+        Storage(engine=engine, read_routing='random')
+
+
+def test_sharded_storage():
+
+    # Generate schema/data
+    descriptor = {
+        'primaryKey': 'id',
+        'fields': [
+            {'name': 'id', 'type': 'integer'},
+            {'name': 'name', 'type': 'string'},
+        ],
+    }
+    rows = [(value, 'name%s' % value) for value in range(0, 2500)]
+
+    # Push rows (shards are written from other threads)
+    connect_args = {}
+    if os.environ['DATABASE_URL'].startswith('sqlite'):
+        connect_args['check_same_thread'] = False
+    engine = create_engine(os.environ['DATABASE_URL'], connect_args=connect_args)
+    storages = [Storage(engine=engine, prefix='test_sharded_storage_%s_' % shard)
+                for shard in range(3)]
+    storage = ShardedStorage(storages)
+    storage.delete()
+    storage.create('bucket', descriptor)
+    summary = storage.write('bucket', rows)
+
+    # Pull rows
+    assert summary.inserted == 2500
+    assert all(0 < len(shard.read('bucket')) < 2500 for shard in storages)
+    assert sorted(storage.read('bucket')) == [list(row) for row in rows]
+    assert storage.read('bucket', ordered=True) == [list(row) for row in rows]
+
+    # Upsert rows (string keys are cast before hashing)
+    summary = storage.write('bucket', [('1', 'updated')], update_keys=['id'])
+    assert summary.updated == 1
+    assert storage.read('bucket', filters={'id': 1}) == [[1, 'updated']]
+
+
+def test_storage_truncate():
+
+    # Push rows
+    engine = create_engine(os.environ['DATABASE_URL'])
+    storage = Storage(engine=engine, prefix='test_storage_truncate_')
+    storage.delete()
+    descriptor = {'fields': [{'name': 'id', 'type': 'integer'}]}
+    storage.create(['bucket1', 'bucket2', 'bucket3'], [descriptor] * 3)
+    for bucket in storage.buckets:
+        storage.write(bucket, [(1,), (2,)])
+
+    # Truncate buckets
+    storage.truncate(['bucket1', 'bucket2'], restart_identity=True)
+    assert storage.read('bucket1') == []
+    assert storage.read('bucket2') == []
+    assert storage.read('bucket3') == [[1], [2]]
+    with pytest.raises(RuntimeError):
+        storage.truncate('missing')
+
+    # Delete buckets
+    storage.delete(['bucket1', 'bucket2', 'missing'], ignore=True)
+    assert storage.buckets == ['bucket3']
+    storage.delete()
+    assert storage.buckets == []
+
+
+def test_storage_profile():
+
+    # Push rows
+    engine = create_engine(os.environ['DATABASE_URL'])
+    storage = Storage(engine=engine, prefix='test_storage_profile_', profile='bulk_load')
+    storage.delete()
+    storage.create('bucket', {'fields': [{'name': 'id', 'type': 'integer'}]})
+    summary = storage.write('bucket', [(value,) for value in range(0, 100)])
+    assert summary.profile == 'bulk_load'
+    summary = storage.write('bucket', [(100,)], profile='low_latency')
+    assert summary.profile == 'low_latency'
+
+    # Pull rows
+    assert len(storage.read('bucket', profile='export')) == 101
+
+    # Unknown profile
+    with pytest.raises(ValueError):
+        storage.write('bucket', [(101,)], profile='unknown')
+
+
+def test_storage_spool(tmpdir):
+
+    # Prepare
+    path = str(tmpdir.join('bucket.spool'))
+    rows = [(value, 'name%s' % value) for value in range(0, 250)]
+    descriptor = {
+        'primaryKey': 'id',
+        'fields': [
+            {'name': 'id', 'type': 'integer'},
+            {'name': 'name', 'type': 'string'},
+        ],
+    }
+    writers = []
+
+    class CountingStrategy(WriteStrategy):
+        def __init__(self, *args, **kwargs):
+            super(CountingStrategy, self).__init__(*args, **kwargs)
+            writers.append(self)
+
+    engine = create_engine(os.environ['DATABASE_URL'])
+    storage = Storage(engine=engine, prefix='test_storage_spool_',
+                      write_strategy=CountingStrategy)
+    storage.delete()
+    storage.create('bucket', descriptor)
+
+    # Push rows stopping without draining, then crashing mid-record
+    spool = storage.spool('bucket', path, update_keys=['id'], batch_size=100)
+    for row in rows:
+        spool.send(row)
+    spool.close(drain=False)
+    with io.open(path, 'ab') as file:
+        file.write(b'\x00\x00\x01')
+
+    # Replay and push more rows, truncating the written spool
+    with storage.spool('bucket', path, update_keys=['id'], batch_size=100) as spool:
+        spool.send((250, 'name250'))
+        for _ in range(100):
+            if spool.written == 251 and os.path.getsize(path) == 0:
+                break
+            time.sleep(0.05)
+        assert os.path.getsize(path) == 0
+        spool.send((251, 'name251'))
+    assert spool.sent == 2
+
+    # Pull rows
+    assert storage.read('bucket') == [list(row) for row in rows] + [
+        [250, 'name250'], [251, 'name251']]
+    assert os.listdir(str(tmpdir)) == []
+
+    # Every spool used a single writer for all batches
+    assert len(writers) <= 2
+
+
+def test_storage_write_coalesce():
+
+    # Prepare
+    descriptor = {
+        'fields': [
+            {'name': 'id', 'type': 'integer'},
+            {'name': 'count', 'type': 'integer'},
+        ],
+    }
+    engine = create_engine(os.environ['DATABASE_URL'])
+    storage = Storage(engine=engine, prefix='test_storage_write_coalesce_')
+    storage.delete()
+    storage.create('bucket', descriptor)
+
+    # Push rows keeping the last one
+    summary = storage.write('bucket', [(1, 1), (2, 1), (1, 2), (1, 3)],
+                            update_keys=['id'], coalesce=True)
+    assert (summary.inserted, summary.updated, summary.coalesced) == (2, 0, 2)
+    assert storage.read('bucket') == [[1, 3], [2, 1]]
+
+    # Push rows merging them
+    def merge(old, new):
+        return dict(new, count=old['count'] + new['count'])
+    summary = storage.write('bucket', [(1, 5), (3, 1), (1, 6)],
+                            update_keys=['id'], coalesce=merge)
+    assert (summary.inserted, summary.updated, summary.coalesced) == (1, 1, 1)
+    assert storage.read('bucket') == [[1, 11], [2, 1], [3, 1]]
+
+    # Push rows not coalescing them
+    summary = storage.write('bucket', [(4, 1), (4, 2)], coalesce=False)
+    assert (summary.inserted, summary.coalesced) == (2, 0)
+    summary = storage.write('bucket', [(5, 1), (5, 2)],
+                            update_keys=['id'], coalesce=False)
+    assert (summary.inserted, summary.updated, summary.coalesced) == (1, 1, 0)
+    assert storage.read('bucket')[-3:] == [[4, 1], [4, 2], [5, 2]]
+
+    # Coalesce without update keys
+    with pytest.raises(ValueError):
+        storage.write('bucket', [(6, 1)], coalesce=True)
+
+
+def test_storage_stats():
+
+    # Push rows
+    engine = create_engine(os.environ['DATABASE_URL'])
+    storage = Storage(engine=engine, prefix='test_storage_stats_')
+    storage.delete()
+    storage.create('bucket', {
+        'fields': [
+            {'name': 'id', 'type': 'integer'},
+            {'name': 'name', 'type': 'string'},
+        ],
+    })
+    storage.write('bucket', [(1, 'a'), (2, 'a'), (3, None), (4, None)])
+
+    # Get exact stats
+    stats = storage.stats('bucket', exact=True)
+    assert stats['rows'] == 4
+    assert stats['columns']['id'] == {'null_fraction': 0.0, 'distinct': 4}
+    assert stats['columns']['name'] == {'null_fraction': 0.5, 'distinct': 1}
+
+
+def test_storage_create_sample():
+
+    # Create bucket sized by a sample
+    descriptor = {
+        'fields': [
+            {'name': 'id', 'type': 'integer'},
+            {'name': 'name', 'type': 'string'},
+        ],
+    }
+    engine = create_engine(os.environ['DATABASE_URL'])
+    storage = Storage(engine=engine, prefix='test_storage_create_sample_')
+    storage.delete()
+    storage.create('bucket', descriptor, compact_types=True,
+                   sample=[('1', 'ab'), ('5', 'abc')])
+
+    # Push rows outside of the sample
+    assert storage.describe('bucket') == descriptor
+    storage.write('bucket', [('6', 'abcd'), ('400', 'abcdef')])
+    assert storage.read('bucket') == [[6, 'abcd'], [400, 'abcdef']]
+
+
+def test_sharded_storage_ordered_hash_column():
+
+    # Push rows (shards are written from other threads)
+    descriptor = {'primaryKey': 'id', 'fields': [{'name': 'id', 'type': 'integer'}]}
+    rows = [(value,) for value in range(0, 100)]
+    connect_args = {}
+    if os.environ['DATABASE_URL'].startswith('sqlite'):
+        connect_args['check_same_thread'] = False
+    engine = create_engine(os.environ['DATABASE_URL'], connect_args=connect_args)
+    storages = [Storage(engine=engine, hash_column='h',
+                        prefix='test_sharded_storage_hash_%s_' % shard)
+                for shard in range(3)]
+    storage = ShardedStorage(storages)
+    storage.delete()
+    storage.create('bucket', descriptor)
+    storage.write('bucket', rows)
+
+    # Pull rows in primary key order
+    assert storages[0].columns('bucket') == ['h', 'id']
+    assert [row[1] for row in storage.read('bucket', ordered=True)] == list(range(0, 100))
+
+
+def test_storage_delete_enum_types():
+
+    # Create bucket with a native enum
+    def descriptor(values):
+        return {'fields': [
+            {'name': 'color', 'type': 'string', 'constraints': {'enum': values}}]}
+    engine = create_engine(os.environ['DATABASE_URL'])
+    storage = Storage(engine=engine, prefix='test_storage_delete_enum_types_')
+    storage.delete()
+    storage.create('bucket', descriptor(['red', 'green']), compact_types=True)
+
+    # Recreate it with other values (the enum type is dropped with the bucket)
+    storage.delete('bucket')
+    storage.create('bucket', descriptor(['blue']), compact_types=True)
+    storage.write('bucket', [('blue',)])
+    assert storage.read('bucket') == [['blue']]
+
+
+def test_storage_json_codec(tmpdir):
+    pytest.importorskip('orjson')
+
+    # Create storages
+    engine = create_engine(os.environ['DATABASE_URL'])
+    descriptor = {'fields': [
+        {'name': 'id', 'type': 'integer'},
+        {'name': 'meta', 'type': 'object'},
+    ]}
+    storage = Storage(engine=engine, prefix='test_storage_json_codec_', json_codec='orjson')
+    default = Storage(engine=engine, prefix='test_storage_json_codec_default_')
+    for item in [storage, default]:
+        item.delete()
+        item.create('bucket', descriptor)
+
+    # Codecs are kept per storage
+    assert getattr(engine.dialect, '_json_serializer', None) is None
+    lines = {
+        storage: '{"id":1,"meta":{"chars":560}}\n',
+        default: '{"id": 1, "meta": {"chars": 560}}\n',
+    }
+    for item, line in lines.items():
+        item.write('bucket', [(1, '{"chars": 560}')])
+        assert item.read('bucket') == [[1, {'chars': 560}]]
+        path = str(tmpdir.join('%s.ndjson' % id(item)))
+        item.dump('bucket', path, format='ndjson')
+        assert io.open(path, encoding='utf-8').read() == line
+
+    # Reflected JSON columns use the codec
+    storage = Storage(engine=engine, prefix='test_storage_json_codec_', json_codec='orjson')
+    storage.write('bucket', [(2, {'chars': 1})])
+    assert storage.read('bucket') == [[1, {'chars': 560}], [2, {'chars': 1}]]
+
+    # Unsupported codec
+    with pytest.raises(ValueError):
+        Storage(engine=engine, json_codec='unknown')
+
+
 # Helpers
 
 def sync_descriptor(descriptor):
@@ -252,3 +942,4 @@ def sync_rows(descriptor, rows):
     for row in rows:
         result.append(schema.cast_row(row))
     return result
+